@@ -1,9 +1,133 @@
 import bpy
-from bpy.props import StringProperty
+import os
+from bpy.props import (
+    BoolProperty,
+    CollectionProperty,
+    FloatProperty,
+    IntProperty,
+    StringProperty,
+)
 from bpy_extras.io_utils import ImportHelper, ExportHelper
+from .modal import ModalTask
+
+
+class SubRosaPreferences(bpy.types.AddonPreferences):
+    bl_idname = __package__
+
+    use_cache: BoolProperty(
+        name="Cache Decoded Files",
+        description="Keep decoded copies of imported files to skip parsing them again",
+        default=True,
+    )
+    cache_size: IntProperty(
+        name="Cache Size (MB)",
+        description="Least recently used entries are removed beyond this size",
+        default=512,
+        min=1,
+    )
+    use_library: BoolProperty(
+        name="Reuse Built Models",
+        description="Save imported models to a library and append them from "
+        "there when the same file is imported again",
+        default=False,
+    )
+
+    def draw(self, context):
+        layout = self.layout
+        layout.prop(self, "use_cache")
+        row = layout.row()
+        row.active = self.use_cache
+        row.prop(self, "cache_size")
+        layout.prop(self, "use_library")
+
+
+def configure_caches(context):
+    from . import cache, library
+
+    preferences = context.preferences.addons[__package__].preferences
+    if preferences.use_cache:
+        directory = bpy.utils.extension_path_user(
+            __package__, path="decoded", create=True
+        )
+        cache.configure(directory, preferences.cache_size * 1024 * 1024)
+    else:
+        cache.configure(None)
+
+    if preferences.use_library:
+        directory = bpy.utils.extension_path_user(
+            __package__, path="library", create=True
+        )
+        library.configure(directory)
+    else:
+        library.configure(None)
+
+
+class ImportFiles(ModalTask, ImportHelper):
+    """Import one or more files, or every matching file in a directory"""
+
+    files: CollectionProperty(
+        type=bpy.types.OperatorFileListElement, options={"HIDDEN", "SKIP_SAVE"}
+    )
+    directory: StringProperty(subtype="DIR_PATH", options={"HIDDEN", "SKIP_SAVE"})
+    import_directory: BoolProperty(
+        name="Whole Directory",
+        description="Import every matching file in the current directory",
+        default=False,
+    )
+    share_mesh: BoolProperty(
+        name="Share Identical Meshes",
+        description="Reuse mesh data from earlier imports with the same geometry, "
+        "for models without bones",
+        default=False,
+    )
+
+    def filepaths(self) -> list[str]:
+        if self.import_directory and self.directory:
+            return [
+                os.path.join(self.directory, name)
+                for name in sorted(os.listdir(self.directory))
+                if name.lower().endswith(self.filename_ext)
+            ]
+        if self.directory and any(file.name for file in self.files):
+            return [
+                os.path.join(self.directory, file.name)
+                for file in self.files
+                if file.name
+            ]
+        return [self.filepath]
+
+    def load_files(self, context, importer):
+        keywords = self.as_keywords(
+            ignore=(
+                "filter_glob",
+                "filepath",
+                "files",
+                "directory",
+                "import_directory",
+                "run_modal",
+            )
+        )
+        configure_caches(context)
+        filepaths = self.filepaths()
+        if not filepaths:
+            self.report({"ERROR"}, "No matching files found")
+            return {"CANCELLED"}
+
+        from . import batch
+
+        task = batch.load_steps(
+            context, filepaths, importer, block=not self.run_modal, **keywords
+        )
+        return self.run_task(context, task)
 
+    def finish_task(self, context, failures):
+        for path, error in failures:
+            self.report({"WARNING"}, f"Could not import {path}: {error}")
+
+        return {"FINISHED"}
 
-class ImportCMO(bpy.types.Operator, ImportHelper):
+
+class ImportCMO(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Object File"""
 
     bl_idname = "import_scene.cmo"
@@ -16,11 +140,10 @@ class ImportCMO(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         from . import import_cmo
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_cmo.load(context, **keywords)
+        return self.load_files(context, import_cmo)
 
 
-class ImportCMC(bpy.types.Operator, ImportHelper):
+class ImportCMC(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Character File"""
 
     bl_idname = "import_scene.cmc"
@@ -30,13 +153,18 @@ class ImportCMC(bpy.types.Operator, ImportHelper):
     filename_ext = ".cmc"
     filter_glob = StringProperty(default="*.cmc", options={"HIDDEN"})
 
+    share_armature: BoolProperty(
+        name="Share Armature",
+        description="Reuse armature data from earlier imports with the same bones",
+        default=False,
+    )
+
     def execute(self, context):
         from . import import_cmc
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_cmc.load(context, **keywords)
+        return self.load_files(context, import_cmc)
 
-class ImportLegacyCMC(bpy.types.Operator, ImportHelper):
+class ImportLegacyCMC(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Character File"""
 
     bl_idname = "import_scene.legacycmc"
@@ -46,14 +174,19 @@ class ImportLegacyCMC(bpy.types.Operator, ImportHelper):
     filename_ext = ".cmc"
     filter_glob = StringProperty(default="*.cmc", options={"HIDDEN"})
 
+    share_armature: BoolProperty(
+        name="Share Armature",
+        description="Reuse armature data from earlier imports with the same bones",
+        default=False,
+    )
+
     def execute(self, context):
         from . import import_legacycmc
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_legacycmc.load(context, **keywords)
+        return self.load_files(context, import_legacycmc)
 
 
-class ImportITM(bpy.types.Operator, ImportHelper):
+class ImportITM(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Item File"""
 
     bl_idname = "import_scene.itm"
@@ -66,11 +199,10 @@ class ImportITM(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         from . import import_itm
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_itm.load(context, **keywords)
+        return self.load_files(context, import_itm)
 
 
-class ImportSIT(bpy.types.Operator, ImportHelper):
+class ImportSIT(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Legacy Item File"""
 
     bl_idname = "import_scene.sit"
@@ -83,11 +215,10 @@ class ImportSIT(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         from . import import_sit
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_sit.load(context, **keywords)
+        return self.load_files(context, import_sit)
 
 
-class ImportSBV(bpy.types.Operator, ImportHelper):
+class ImportSBV(bpy.types.Operator, ImportFiles):
     """Load a Sub Rosa Vehicle File"""
 
     bl_idname = "import_scene.sbv"
@@ -100,8 +231,81 @@ class ImportSBV(bpy.types.Operator, ImportHelper):
     def execute(self, context):
         from . import import_sbv
 
-        keywords = self.as_keywords(ignore=("filter_glob",))
-        return import_sbv.load(context, **keywords)
+        return self.load_files(context, import_sbv)
+
+
+class ReloadModels(bpy.types.Operator):
+    """Reload imported Sub Rosa models whose files have changed"""
+
+    bl_idname = "import_scene.subrosa_reload"
+    bl_label = "Reload Sub Rosa Models"
+    bl_options = {"REGISTER", "UNDO"}
+
+    selected_only: BoolProperty(
+        name="Selected Only",
+        description="Only reload the selected objects",
+        default=False,
+    )
+
+    @classmethod
+    def poll(cls, context):
+        # Reloading can rebuild bones, which needs object mode
+        return context.mode == "OBJECT"
+
+    def execute(self, context):
+        from . import reload
+
+        configure_caches(context)
+        objects = context.selected_objects if self.selected_only else bpy.data.objects
+        reloaded, failures = reload.reload_changed(context, objects)
+        for path, error in failures:
+            self.report({"WARNING"}, f"Could not reload {path}: {error}")
+
+        self.report({"INFO"}, f"Reloaded {reloaded} file(s)")
+        return {"FINISHED"}
+
+
+class WatchModels(bpy.types.Operator):
+    """Start or stop reloading imported Sub Rosa models as their files change"""
+
+    bl_idname = "import_scene.subrosa_watch"
+    bl_label = "Watch Sub Rosa Models"
+
+    interval: FloatProperty(
+        name="Interval",
+        description="Seconds between checks for changed files",
+        default=1.0,
+        min=0.1,
+    )
+
+    def execute(self, context):
+        from . import reload
+
+        if reload.is_watching():
+            reload.unwatch()
+            self.report({"INFO"}, "Stopped watching imported files")
+        else:
+            configure_caches(context)
+            reload.watch(self.interval)
+            self.report({"INFO"}, "Watching imported files for changes")
+
+        return {"FINISHED"}
+
+
+class ReportWatchFailures(bpy.types.Operator):
+    """Show files that could not be reloaded while watching"""
+
+    bl_idname = "import_scene.subrosa_watch_report"
+    bl_label = "Report Sub Rosa Reload Failures"
+    bl_options = {"INTERNAL"}
+
+    def execute(self, context):
+        from . import reload
+
+        for path, error in reload.report_failures():
+            self.report({"WARNING"}, f"Could not reload {path}: {error}")
+
+        return {"FINISHED"}
 
 
 def menu_func_import(self, context):
@@ -111,9 +315,11 @@ def menu_func_import(self, context):
     self.layout.operator(ImportITM.bl_idname, text="Sub Rosa Item (.itm)")
     self.layout.operator(ImportSIT.bl_idname, text="Sub Rosa Legacy Item (.sit)")
     self.layout.operator(ImportSBV.bl_idname, text="Sub Rosa Vehicle (.sbv)")
+    self.layout.operator(ReloadModels.bl_idname)
+    self.layout.operator(WatchModels.bl_idname)
 
 
-class ExportCMO(bpy.types.Operator, ExportHelper):
+class ExportCMO(bpy.types.Operator, ModalTask, ExportHelper):
     """Export a Sub Rosa Object File"""
 
     bl_idname = "export_scene.cmo"
@@ -122,14 +328,30 @@ class ExportCMO(bpy.types.Operator, ExportHelper):
     filename_ext = ".cmo"
     filter_glob = StringProperty(default="*.cmo", options={"HIDDEN"})
 
+    skip_unchanged: BoolProperty(
+        name="Skip Unchanged",
+        description="Leave the file as it is when nothing exported to it has "
+        "changed since the last export",
+        default=False,
+    )
+
     def execute(self, context):
         from . import export_cmo
 
-        keywords = self.as_keywords(ignore=("filter_glob", "check_existing"))
-        return export_cmo.save(context, **keywords)
+        keywords = self.as_keywords(
+            ignore=("filter_glob", "check_existing", "run_modal")
+        )
+        task = export_cmo.save_steps(context, block=not self.run_modal, **keywords)
+        return self.run_task(context, task)
 
+    def finish_task(self, context, message):
+        if message:
+            self.report({"INFO"}, message)
+
+        return {"FINISHED"}
 
-class ExportCMC(bpy.types.Operator, ExportHelper):
+
+class ExportCMC(bpy.types.Operator, ModalTask, ExportHelper):
     """Export a Sub Rosa Character File"""
 
     bl_idname = "export_scene.cmc"
@@ -138,17 +360,34 @@ class ExportCMC(bpy.types.Operator, ExportHelper):
     filename_ext = ".cmc"
     filter_glob = StringProperty(default="*.cmc", options={"HIDDEN"})
 
+    skip_unchanged: BoolProperty(
+        name="Skip Unchanged",
+        description="Leave the file as it is when nothing exported to it has "
+        "changed since the last export",
+        default=False,
+    )
+
     def execute(self, context):
         from . import export_cmc
 
-        keywords = self.as_keywords(ignore=("filter_glob", "check_existing"))
-        didError, message = export_cmc.save(context, **keywords)
+        keywords = self.as_keywords(
+            ignore=("filter_glob", "check_existing", "run_modal")
+        )
+        task = export_cmc.save_steps(context, block=not self.run_modal, **keywords)
+        return self.run_task(context, task)
+
+    def finish_task(self, context, result):
+        didError, message = result
         if didError:
             self.report({"INFO"}, message)
             return {"CANCELLED"}
+        if message:
+            self.report({"INFO"}, message)
 
         return {"FINISHED"}
-class ExportLegacyCMC(bpy.types.Operator, ExportHelper):
+
+
+class ExportLegacyCMC(bpy.types.Operator, ModalTask, ExportHelper):
     """Export a Legacy Sub Rosa Character File"""
 
     bl_idname = "export_scene.legacycmc"
@@ -157,25 +396,124 @@ class ExportLegacyCMC(bpy.types.Operator, ExportHelper):
     filename_ext = ".cmc"
     filter_glob = StringProperty(default="*.cmc", options={"HIDDEN"})
 
+    skip_unchanged: BoolProperty(
+        name="Skip Unchanged",
+        description="Leave the file as it is when nothing exported to it has "
+        "changed since the last export",
+        default=False,
+    )
+
     def execute(self, context):
         from . import export_legacycmc
 
-        keywords = self.as_keywords(ignore=("filter_glob", "check_existing"))
-        didError, message = export_legacycmc.save(context, **keywords)
+        keywords = self.as_keywords(
+            ignore=("filter_glob", "check_existing", "run_modal")
+        )
+        task = export_legacycmc.save_steps(
+            context, block=not self.run_modal, **keywords
+        )
+        return self.run_task(context, task)
+
+    def finish_task(self, context, result):
+        didError, message = result
         if didError:
             self.report({"INFO"}, message)
             return {"CANCELLED"}
+        if message:
+            self.report({"INFO"}, message)
+
+        return {"FINISHED"}
+
+
+class ExportCharacterFiles(ModalTask):
+    """Export every mesh parented to an armature to its own file"""
+
+    directory: StringProperty(subtype="DIR_PATH", options={"HIDDEN", "SKIP_SAVE"})
+    filter_folder: BoolProperty(default=True, options={"HIDDEN"})
+    filename_pattern: StringProperty(
+        name="File Name",
+        description="Name of each file, where {name} is replaced by the mesh's "
+        "name and {armature} by its armature's",
+        default="{name}",
+    )
+    selected_only: BoolProperty(
+        name="Selected Only",
+        description="Only export the selected meshes",
+        default=False,
+    )
+    skip_unchanged: BoolProperty(
+        name="Skip Unchanged",
+        description="Leave files as they are when nothing exported to them has "
+        "changed since the last export",
+        default=False,
+    )
+
+    def invoke(self, context, event):
+        self.run_modal = True
+        context.window_manager.fileselect_add(self)
+        return {"RUNNING_MODAL"}
+
+    def save_files(self, context, exporter):
+        if not self.directory:
+            self.report({"ERROR"}, "Choose a directory to export to")
+            return {"CANCELLED"}
+
+        keywords = self.as_keywords(ignore=("filter_folder", "run_modal"))
+        task = exporter.save_all_steps(context, block=not self.run_modal, **keywords)
+        return self.run_task(context, task)
+
+    def finish_task(self, context, result):
+        exported, skipped, failures = result
+        if not (exported or skipped or failures):
+            self.report({"ERROR"}, "No meshes with an armature as their parent")
+            return {"CANCELLED"}
 
+        for failure in failures:
+            self.report({"WARNING"}, f"Could not export {failure}")
+        self.report(
+            {"INFO"}, f"Exported {exported} character(s), {skipped} unchanged"
+        )
         return {"FINISHED"}
 
 
+class ExportCMCCharacters(bpy.types.Operator, ExportCharacterFiles):
+    """Export every Sub Rosa Character in the scene to its own file"""
+
+    bl_idname = "export_scene.cmc_batch"
+    bl_label = "Export CMC Characters"
+
+    def execute(self, context):
+        from . import export_cmc
+
+        return self.save_files(context, export_cmc)
+
+
+class ExportLegacyCMCCharacters(bpy.types.Operator, ExportCharacterFiles):
+    """Export every Legacy Sub Rosa Character in the scene to its own file"""
+
+    bl_idname = "export_scene.legacycmc_batch"
+    bl_label = "Export Legacy CMC Characters"
+
+    def execute(self, context):
+        from . import export_legacycmc
+
+        return self.save_files(context, export_legacycmc)
+
+
 def menu_func_export(self, context):
     self.layout.operator(ExportCMO.bl_idname, text="Sub Rosa Object (.cmo)")
     self.layout.operator(ExportCMC.bl_idname, text="Sub Rosa Character (.cmc)")
     self.layout.operator(ExportLegacyCMC.bl_idname, text="Legacy Sub Rosa Character (.cmc)")
+    self.layout.operator(
+        ExportCMCCharacters.bl_idname, text="Sub Rosa Characters (.cmc, batch)"
+    )
+    self.layout.operator(
+        ExportLegacyCMCCharacters.bl_idname,
+        text="Legacy Sub Rosa Characters (.cmc, batch)",
+    )
 
 
-classes = (ImportCMO, ImportCMC, ImportLegacyCMC, ImportITM, ImportSIT, ImportSBV, ExportCMO, ExportCMC, ExportLegacyCMC)
+classes = (SubRosaPreferences, ImportCMO, ImportCMC, ImportLegacyCMC, ImportITM, ImportSIT, ImportSBV, ReloadModels, WatchModels, ReportWatchFailures, ExportCMO, ExportCMC, ExportLegacyCMC, ExportCMCCharacters, ExportLegacyCMCCharacters)
 
 
 def register():
@@ -187,6 +525,10 @@ def register():
 
 
 def unregister():
+    from . import reload
+
+    reload.unwatch()
+
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
 
@@ -0,0 +1,83 @@
+import bpy
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from types import ModuleType
+from . import library, modal, shared
+
+
+def load_steps(
+    context: bpy.types.Context,
+    filepaths: list[str],
+    importer: ModuleType,
+    block: bool = True,
+    **keywords,
+):
+    # Worker threads read and decode files while the main thread builds
+    # Blender data from them in order, one file per step. At most
+    # `pending_limit` files are in flight at once, which bounds memory use
+    # on large directories.
+    workers = max(1, min(len(filepaths), os.cpu_count() or 1))
+    pending_limit = workers * 2
+    failures: list[tuple[str, Exception]] = []
+
+    if len(filepaths) == 1:
+        name = bpy.path.display_name_from_filepath(filepaths[0])
+    else:
+        name = os.path.basename(os.path.dirname(filepaths[0])) or "Import"
+    paths = iter(filepaths)
+    pending: deque[tuple[str, Future]] = deque()
+
+    pool = ThreadPoolExecutor(workers)
+
+    def submit(count: int):
+        for path in islice(paths, count):
+            pending.append((path, pool.submit(library.prepare, importer, path)))
+
+    session = shared.ImportSession(context, name)
+    try:
+        submit(pending_limit)
+        done = 0
+        while pending:
+            path, future = pending[0]
+            try:
+                prepared = yield from modal.wait_for(
+                    future, (done, len(filepaths)), block
+                )
+            except Exception as error:
+                failures.append((path, error))
+            else:
+                object_name = bpy.path.display_name_from_filepath(path)
+                first = len(session.objects)
+                try:
+                    library.build(
+                        session, importer, path, object_name, prepared, **keywords
+                    )
+                except Exception as error:
+                    # A bad file only loses its own objects, not the batch
+                    session.discard(first)
+                    failures.append((path, error))
+
+            pending.popleft()
+            submit(1)
+            done += 1
+            yield done, len(filepaths)
+
+        session.finish()
+    except BaseException:
+        session.discard()
+        raise
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+    return failures
+
+
+def load(
+    context: bpy.types.Context,
+    filepaths: list[str],
+    importer: ModuleType,
+    **keywords,
+) -> list[tuple[str, Exception]]:
+    return modal.drain(load_steps(context, filepaths, importer, **keywords))
@@ -0,0 +1,154 @@
+import hashlib
+import numpy as np
+import os
+import tempfile
+import threading
+from typing import Callable, NamedTuple, Optional, get_args, get_type_hints
+
+# Bump whenever the decoded layout changes, so stale entries are never read
+cache_version = 1
+
+
+def to_arrays(decoded: NamedTuple, prefix: str = "") -> dict[str, np.ndarray]:
+    arrays = {}
+    for field, value in zip(decoded._fields, decoded):
+        key = prefix + field
+        if value is None:
+            continue
+        if isinstance(value, tuple):
+            arrays.update(to_arrays(value, key + "."))
+        else:
+            arrays[key] = np.asarray(value)
+    return arrays
+
+
+def from_arrays(cls: type, arrays: dict[str, np.ndarray], prefix: str = ""):
+    hints = get_type_hints(cls)
+    values = []
+    for field in cls._fields:
+        key = prefix + field
+        field_type = hints[field]
+        if type(None) in get_args(field_type):
+            field_type = get_args(field_type)[0]
+
+        if isinstance(field_type, type) and issubclass(field_type, tuple):
+            if any(name.startswith(key + ".") for name in arrays):
+                values.append(from_arrays(field_type, arrays, key + "."))
+            else:
+                values.append(None)
+        else:
+            values.append(arrays.get(key))
+    return cls(*values)
+
+
+# (path, size, mtime) -> content hash, so unchanged files are only hashed
+# once per session
+_digests: dict[tuple[str, int, int], str] = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(filepath: str) -> str:
+    stat = os.stat(filepath)
+    identity = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(identity)
+
+    if digest is None:
+        content_hash = hashlib.blake2b(digest_size=20)
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                content_hash.update(chunk)
+        digest = content_hash.hexdigest()
+        with _digests_lock:
+            _digests[identity] = digest
+
+    return digest
+
+
+class DecodedCache:
+    """On-disk cache of decoded models, keyed by file content, evicting LRU"""
+
+    def __init__(self, directory: str, size_limit: int):
+        self.directory = directory
+        self.size_limit = size_limit
+        self._lock = threading.Lock()
+
+    def key(self, filepath: str, kind: str) -> str:
+        return f"{kind}-{cache_version}-{file_digest(filepath)}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key: str) -> Optional[dict[str, np.ndarray]]:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            # Touching the entry marks it as most recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key: str, arrays: dict[str, np.ndarray]):
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(".tmp", dir=self.directory)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    if entry.name.endswith(".npz"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.size_limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+active_cache: Optional[DecodedCache] = None
+
+
+def configure(directory: Optional[str], size_limit: int = 0):
+    global active_cache
+    if directory is None or size_limit <= 0:
+        active_cache = None
+    elif active_cache is None or active_cache.directory != directory:
+        active_cache = DecodedCache(directory, size_limit)
+    else:
+        active_cache.size_limit = size_limit
+
+
+def fetch(filepath: str, decode: Callable[[str], NamedTuple], cls: type):
+    # Safe to call from worker threads; the cache is configured up front on
+    # the main thread.
+    decoded_cache = active_cache
+    if decoded_cache is None:
+        return decode(filepath)
+
+    key = decoded_cache.key(filepath, cls.__name__)
+    arrays = decoded_cache.get(key)
+    if arrays is not None:
+        return from_arrays(cls, arrays)
+
+    decoded = decode(filepath)
+    decoded_cache.put(key, to_arrays(decoded))
+    return decoded
@@ -0,0 +1,529 @@
+import numpy as np
+from functools import partial
+from struct import pack, unpack_from
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+# Sub Rosa is Y-up, so files store (x, z, y) in Blender terms
+swizzle = (0, 2, 1)
+
+
+class Polygons(NamedTuple):
+    loop_start: np.ndarray
+    loop_total: np.ndarray
+    vertex_index: np.ndarray
+
+
+class Skin(NamedTuple):
+    # Up to 4 influences per vertex, packed to the front in bone order;
+    # unused slots have a weight of 0.
+    bone_indices: np.ndarray
+    weights: np.ndarray
+    offsets: np.ndarray
+
+
+class DecodedMesh(NamedTuple):
+    vertices: np.ndarray
+    polygons: Polygons
+    vertex_uvs: Optional[np.ndarray] = None
+    vertex_weights: Optional[Skin] = None
+    bones: Optional[np.ndarray] = None
+
+
+class DecodedVehicle(NamedTuple):
+    body: DecodedMesh
+    collision: DecodedMesh
+    windows: DecodedMesh
+
+
+def cmc_vertex_dtype(bone_count: int) -> np.dtype:
+    # 12 + 16 * bone_count + 8 bytes per record, no padding
+    return np.dtype(
+        [
+            ("co", "<f4", (3,)),
+            ("weights", "<f4", (bone_count, 4)),
+            ("uv", "<f4", (2,)),
+        ]
+    )
+
+
+vector_dtype = np.dtype(("<f4", (3,)))
+triangle_dtype = np.dtype(("<i4", (3,)))
+itm_vertex_dtype = np.dtype([("co", "<f4", (3,)), ("uv", "<f4", (2,))])
+sit_vertex_dtype = itm_vertex_dtype
+cmo_vertex_dtype = np.dtype([("co", "<f4", (3,)), ("uv", "<f4", (2,)), ("", "V4")])
+cmo_triangle_dtype = np.dtype(
+    [("loop_total", "<i4"), ("vertex_index", "<i4", (3,)), ("", "V8")]
+)
+cmo_legacy_vertex_dtype = np.dtype([("co", "<f4", (3,)), ("", "V4")])
+sbv_collision_vertex_dtype = np.dtype([("co", "<f4", (3,)), ("", "V4")])
+
+
+class Section(NamedTuple):
+    name: str
+    offset: int
+    end: int
+    decode: Callable[[], Any]
+
+
+class SectionIndex:
+    # Sections are located on demand by walking the format's layout
+    # generator, so asking for an early section never touches the bytes
+    # behind it. Decoded sections are cached and are views into the buffer
+    # wherever the on-disk layout allows it.
+    def __init__(self, buffer, layout: Callable[[Any], Iterator[Section]]):
+        self.buffer = buffer
+        self._layout = layout(buffer)
+        self._sections: dict[str, Section] = {}
+        self._decoded: dict[str, Any] = {}
+
+    def find(self, name: str) -> Section:
+        while name not in self._sections:
+            section = next(self._layout, None)
+            if section is None:
+                raise KeyError(name)
+            self._sections[section.name] = section
+        return self._sections[name]
+
+    def view(self, name: str) -> memoryview:
+        section = self.find(name)
+        return memoryview(self.buffer)[section.offset : section.end]
+
+    def __getitem__(self, name: str):
+        if name not in self._decoded:
+            self._decoded[name] = self.find(name).decode()
+        return self._decoded[name]
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            self.find(name)
+        except KeyError:
+            return False
+        return True
+
+    def clear(self):
+        self._decoded.clear()
+
+
+def view(buffer, dtype: np.dtype, offset: int, count: int, field: Optional[str] = None):
+    array = np.frombuffer(buffer, dtype, count, offset)
+    return array if field is None else array[field]
+
+
+def array_section(
+    name: str, buffer, dtype: np.dtype, offset: int, count: int, field=None
+) -> Section:
+    end = offset + np.dtype(dtype).itemsize * count
+    decode = partial(view, buffer, dtype, offset, count, field)
+    return Section(name, offset, end, decode)
+
+
+def compact_skin(dense: np.ndarray) -> Skin:
+    # The file stores an (offset, weight) record for every bone of every
+    # vertex; only the first 4 with a positive weight influence a vertex.
+    vertex_count = len(dense)
+    positive = dense[:, :, 3] > 0.0
+    rank = np.cumsum(positive, axis=1, dtype=np.int8)
+    vertex, bone = np.nonzero(positive & (rank <= 4))
+    slot = rank[vertex, bone] - 1
+
+    bone_indices = np.zeros((vertex_count, 4), dtype=np.int8)
+    weights = np.zeros((vertex_count, 4), dtype=np.float32)
+    offsets = np.zeros((vertex_count, 4, 3), dtype=np.float32)
+    bone_indices[vertex, slot] = bone
+    weights[vertex, slot] = dense[vertex, bone, 3]
+    offsets[vertex, slot] = dense[vertex, bone, :3]
+    return Skin(bone_indices, weights, offsets)
+
+
+def decode_skin(buffer, dtype: np.dtype, offset: int, count: int) -> Skin:
+    return compact_skin(view(buffer, dtype, offset, count, "weights"))
+
+
+def skin_section(name: str, buffer, dtype: np.dtype, offset: int, count: int):
+    end = offset + dtype.itemsize * count
+    decode = partial(decode_skin, buffer, dtype, offset, count)
+    return Section(name, offset, end, decode)
+
+
+def triangle_polygons(faces: np.ndarray) -> Polygons:
+    face_count = len(faces)
+    return Polygons(
+        np.arange(0, face_count * 3, 3, dtype=np.int32),
+        np.full(face_count, 3, dtype=np.int32),
+        faces.reshape(-1),
+    )
+
+
+def decode_triangles(buffer, offset: int, count: int) -> Polygons:
+    return triangle_polygons(view(buffer, triangle_dtype, offset, count))
+
+
+def triangle_section(name: str, buffer, offset: int) -> Section:
+    (face_count,) = unpack_from("<i", buffer, offset)
+    offset += 4
+    end = offset + triangle_dtype.itemsize * face_count
+    decode = partial(decode_triangles, buffer, offset, face_count)
+    return Section(name, offset, end, decode)
+
+
+def gather(buffer, byte_offsets: np.ndarray, dtype="<i4", width: int = 0):
+    # All fields in these formats are 4 bytes wide, so every offset in a
+    # section shares the same alignment and can index one flat word view.
+    base = int(byte_offsets[0]) % 4 if len(byte_offsets) else 0
+    words = np.frombuffer(buffer, dtype, (len(buffer) - base) // 4, base)
+    index = (byte_offsets - base) // 4
+    if width:
+        index = index[:, None] + np.arange(width)
+    return words[index]
+
+
+def index_polygons(
+    buffer, offset: int, count: int, corner_size: int = 4, head: int = 0, tail: int = 0
+) -> tuple[np.ndarray, np.ndarray, int]:
+    # Each record is: head bytes, an int32 corner count, count * corner_size
+    # bytes (the first 4 of which are the vertex index), then tail bytes.
+    # This is the first pass: find every record offset from the prefixes.
+    record_offsets = np.empty(count, dtype=np.int64)
+    loop_total = np.empty(count, dtype=np.int32)
+    if not count:
+        return record_offsets, loop_total, offset
+
+    (first_total,) = unpack_from("<i", buffer, offset + head)
+    stride = head + 4 + first_total * corner_size + tail
+    end = offset + stride * count
+    if end <= len(buffer):
+        # Try the common case where every polygon has the same corner
+        # count; it holds exactly when every predicted prefix agrees.
+        record_offsets[:] = np.arange(offset, end, stride)
+        loop_total[:] = gather(buffer, record_offsets + head)
+        if np.all(loop_total == first_total):
+            return record_offsets, loop_total, end
+
+    for index in range(count):
+        (total,) = unpack_from("<i", buffer, offset + head)
+        record_offsets[index] = offset
+        loop_total[index] = total
+        offset += head + 4 + total * corner_size + tail
+
+    return record_offsets, loop_total, offset
+
+
+def corner_offsets(
+    record_offsets: np.ndarray,
+    loop_total: np.ndarray,
+    corner_size: int = 4,
+    head: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Second pass: expand the record index into one byte offset per corner.
+    loop_start = np.zeros(len(loop_total), dtype=np.int32)
+    np.cumsum(loop_total[:-1], out=loop_start[1:])
+
+    face = np.repeat(np.arange(len(loop_total)), loop_total)
+    corner = np.arange(len(face)) - loop_start[face]
+    return loop_start, record_offsets[face] + head + 4 + corner * corner_size
+
+
+def reverse_winding(loop_start: np.ndarray, loop_total: np.ndarray) -> np.ndarray:
+    face = np.repeat(np.arange(len(loop_total)), loop_total)
+    corner = np.arange(len(face)) - loop_start[face]
+    return (loop_start[face] + loop_total[face] - 1 - corner).astype(np.int32)
+
+
+def decode_polygons(
+    buffer,
+    record_offsets: np.ndarray,
+    loop_total: np.ndarray,
+    corner_size: int = 4,
+    head: int = 0,
+    reverse: bool = False,
+) -> Polygons:
+    loop_start, offsets = corner_offsets(record_offsets, loop_total, corner_size, head)
+    if reverse:
+        offsets = offsets[reverse_winding(loop_start, loop_total)]
+
+    return Polygons(loop_start, loop_total, gather(buffer, offsets))
+
+
+def polygon_section(
+    name: str,
+    buffer,
+    offset: int,
+    corner_size: int = 4,
+    head: int = 0,
+    tail: int = 0,
+    reverse: bool = False,
+) -> Section:
+    (face_count,) = unpack_from("<i", buffer, offset)
+    offset += 4
+    record_offsets, loop_total, end = index_polygons(
+        buffer, offset, face_count, corner_size, head, tail
+    )
+    decode = partial(
+        decode_polygons, buffer, record_offsets, loop_total, corner_size, head, reverse
+    )
+    return Section(name, offset, end, decode)
+
+
+def decode_windows(buffer, record_offsets: np.ndarray, loop_total: np.ndarray):
+    # Windows store their vertices inline, one unshared vertex per corner.
+    loop_start, offsets = corner_offsets(record_offsets, loop_total, 4 * 3)
+    vertices = gather(buffer, offsets, "<f4", 3)
+    polygons = Polygons(loop_start, loop_total, reverse_winding(loop_start, loop_total))
+    return DecodedMesh(vertices, polygons)
+
+
+def cmc_layout(buffer) -> Iterator[Section]:
+    # Skip the magic number
+    version, bone_count = unpack_from("<ii", buffer, 4)
+    assert version == 2, "Unknown file version."
+    offset = 12
+
+    bones = array_section("bones", buffer, vector_dtype, offset, bone_count)
+    yield bones
+
+    (vertex_count,) = unpack_from("<i", buffer, bones.end)
+    offset = bones.end + 4
+    dtype = cmc_vertex_dtype(bone_count)
+    # Positions, weights and UVs are interleaved in one record block
+    vertices = array_section("vertices", buffer, dtype, offset, vertex_count, "co")
+    yield vertices
+    yield skin_section("weights", buffer, dtype, offset, vertex_count)
+    yield array_section("uvs", buffer, dtype, offset, vertex_count, "uv")
+
+    yield triangle_section("faces", buffer, vertices.end)
+
+
+def itm_layout(buffer) -> Iterator[Section]:
+    (version,) = unpack_from("<i", buffer, 0)
+    assert version == 1, "Unknown file version."
+    offset = 4 + 4 * 6
+
+    # Skip the node table
+    (node_count,) = unpack_from("<i", buffer, offset)
+    offset += 4 + 4 * 4 * node_count
+
+    (vertex_count,) = unpack_from("<i", buffer, offset)
+    offset += 4
+    dtype = itm_vertex_dtype
+    vertices = array_section("vertices", buffer, dtype, offset, vertex_count, "co")
+    yield vertices
+    yield array_section("uvs", buffer, dtype, offset, vertex_count, "uv")
+
+    yield polygon_section("faces", buffer, vertices.end)
+
+
+def cmo_layout(buffer) -> Iterator[Section]:
+    # Skip the magic number
+    version, vertex_count = unpack_from("<ii", buffer, 4)
+    assert version <= 3, "Unknown file version."
+    offset = 12
+
+    if version >= 3:
+        dtype = cmo_vertex_dtype
+        uvs = array_section("uvs", buffer, dtype, offset, vertex_count, "uv")
+    else:
+        dtype = cmo_legacy_vertex_dtype
+        uvs = Section(
+            "uvs", offset, offset, partial(np.zeros, (vertex_count, 2), np.float32)
+        )
+    vertices = array_section("vertices", buffer, dtype, offset, vertex_count, "co")
+    yield vertices
+    yield uvs
+
+    yield polygon_section("faces", buffer, vertices.end, tail=8 if version > 1 else 4)
+
+
+def sit_layout(buffer) -> Iterator[Section]:
+    (version,) = unpack_from("<i", buffer, 0)
+    assert version == 2, "Unknown file version."
+    # Skip the texture file name
+    offset = 4 + 64
+
+    (vertex_count,) = unpack_from("<i", buffer, offset)
+    offset += 4
+    dtype = sit_vertex_dtype
+    vertices = array_section("vertices", buffer, dtype, offset, vertex_count, "co")
+    yield vertices
+    yield array_section("uvs", buffer, dtype, offset, vertex_count, "uv")
+
+    yield triangle_section("faces", buffer, vertices.end)
+
+
+def sbv_layout(buffer) -> Iterator[Section]:
+    (version,) = unpack_from("<i", buffer, 0)
+    assert version <= 5, "Unknown file version."
+    offset = 4
+
+    if version >= 5:
+        offset += 4 * 3
+
+    (collision_vertex_count,) = unpack_from("<i", buffer, offset)
+    offset += 4
+    collision_vertices = array_section(
+        "collision_vertices",
+        buffer,
+        sbv_collision_vertex_dtype,
+        offset,
+        collision_vertex_count,
+        "co",
+    )
+    yield collision_vertices
+
+    (unused_struct_count,) = unpack_from("<i", buffer, collision_vertices.end)
+    offset = collision_vertices.end + 4 + 4 * 3 * unused_struct_count
+
+    collision_faces = polygon_section("collision_faces", buffer, offset, reverse=True)
+    yield collision_faces
+
+    (vertex_count,) = unpack_from("<i", buffer, collision_faces.end)
+    offset = collision_faces.end + 4
+    vertices = array_section("vertices", buffer, vector_dtype, offset, vertex_count)
+    yield vertices
+
+    # Every face carries 4 leading bytes, 16 bytes after each vertex index
+    # and 16 trailing bytes.
+    faces = polygon_section("faces", buffer, vertices.end, 4 + 4 * 4, 4, 4 * 4)
+    yield faces
+
+    (window_count,) = unpack_from("<i", buffer, faces.end)
+    offset = faces.end + 4
+    record_offsets, loop_total, end = index_polygons(
+        buffer, offset, window_count, 4 * 3
+    )
+    decode = partial(decode_windows, buffer, record_offsets, loop_total)
+    yield Section("windows", offset, end, decode)
+
+
+layouts = {
+    ".cmc": cmc_layout,
+    ".cmo": cmo_layout,
+    ".itm": itm_layout,
+    ".sit": sit_layout,
+    ".sbv": sbv_layout,
+}
+
+
+def decode_mesh(sections: SectionIndex) -> DecodedMesh:
+    return DecodedMesh(
+        sections["vertices"],
+        sections["faces"],
+        sections["uvs"] if "uvs" in sections else None,
+        sections["weights"] if "weights" in sections else None,
+        sections["bones"] if "bones" in sections else None,
+    )
+
+
+def decode_vehicle(sections: SectionIndex) -> DecodedVehicle:
+    return DecodedVehicle(
+        DecodedMesh(sections["vertices"], sections["faces"]),
+        DecodedMesh(sections["collision_vertices"], sections["collision_faces"]),
+        sections["windows"],
+    )
+
+
+def detach(decoded: NamedTuple):
+    # Copies every array out of the buffer it views, so the result can
+    # outlive the buffer (e.g. a memory map that is closed afterwards)
+    return type(decoded)(
+        *(
+            detach(value)
+            if isinstance(value, tuple)
+            else None if value is None else np.array(value)
+            for value in decoded
+        )
+    )
+
+
+def decode_cmc(buffer) -> DecodedMesh:
+    return decode_mesh(SectionIndex(buffer, cmc_layout))
+
+
+def decode_itm(buffer) -> DecodedMesh:
+    return decode_mesh(SectionIndex(buffer, itm_layout))
+
+
+def decode_cmo(buffer) -> DecodedMesh:
+    return decode_mesh(SectionIndex(buffer, cmo_layout))
+
+
+def decode_sit(buffer) -> DecodedMesh:
+    return decode_mesh(SectionIndex(buffer, sit_layout))
+
+
+def decode_sbv(buffer) -> DecodedVehicle:
+    return decode_vehicle(SectionIndex(buffer, sbv_layout))
+
+
+# Encoders take Blender-space arrays and return the file as a list of
+# contiguous buffers, one per section, each written with a single call.
+
+
+def split_uv_seams(
+    loop_vertices: np.ndarray, loop_uvs: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # The format has one UV per vertex, so every distinct (vertex, uv) pair
+    # becomes an output vertex. Returns the source vertex and UV of each
+    # output vertex, and the output vertex of each loop.
+    # Adding 0.0 turns -0.0 into 0.0 so both compare equal bitwise.
+    uv_bits = (np.asarray(loop_uvs, np.float32) + np.float32(0.0)).view(np.int32)
+    keys = np.column_stack((loop_vertices, uv_bits))
+    unique_keys, first_loops, loop_remap = np.unique(
+        keys, axis=0, return_index=True, return_inverse=True
+    )
+    return unique_keys[:, 0], loop_uvs[first_loops], loop_remap.reshape(-1)
+
+
+def encode_cmc(
+    bones: np.ndarray,
+    vertices: np.ndarray,
+    weights: np.ndarray,
+    uvs: np.ndarray,
+    faces: np.ndarray,
+) -> list:
+    # weights holds an (x, y, z, weight) record for every bone of every vertex
+    vertex_count = len(vertices)
+    weights = np.asarray(weights, np.float32).reshape(vertex_count, -1, 4)
+    records = np.empty(vertex_count, cmc_vertex_dtype(weights.shape[1]))
+    records["co"] = np.asarray(vertices).reshape(-1, 3)[:, swizzle]
+    records["weights"] = weights[:, :, (*swizzle, 3)]
+    records["uv"] = np.asarray(uvs).reshape(-1, 2)
+
+    bones = np.asarray(bones, "<f4").reshape(-1, 3)[:, swizzle]
+    faces = np.asarray(faces, "<i4").reshape(-1, 3)
+    return [
+        pack("<4sii", b"CMod", 2, len(bones)),
+        np.ascontiguousarray(bones),
+        pack("<i", vertex_count),
+        records,
+        pack("<i", len(faces)),
+        np.ascontiguousarray(faces),
+    ]
+
+
+def cmo_header(vertex_count: int) -> bytes:
+    return pack("<4sii", b"CMod", 3, vertex_count)
+
+
+def cmo_vertex_records(vertices: np.ndarray, uvs: np.ndarray) -> np.ndarray:
+    records = np.zeros(len(vertices), cmo_vertex_dtype)
+    records["co"] = np.asarray(vertices).reshape(-1, 3)[:, swizzle]
+    records["uv"] = np.asarray(uvs).reshape(-1, 2)
+    return records
+
+
+def cmo_face_records(faces: np.ndarray) -> np.ndarray:
+    faces = np.asarray(faces).reshape(-1, 3)
+    records = np.zeros(len(faces), cmo_triangle_dtype)
+    records["loop_total"] = 3
+    records["vertex_index"] = faces
+    return records
+
+
+def encode_cmo(vertices: np.ndarray, uvs: np.ndarray, faces: np.ndarray) -> list:
+    face_records = cmo_face_records(faces)
+    return [
+        cmo_header(len(vertices)),
+        cmo_vertex_records(vertices, uvs),
+        pack("<i", len(face_records)),
+        face_records,
+    ]
@@ -1,62 +1,153 @@
 import bpy
-import bmesh
-import mathutils
-from struct import pack
-
-bone_names = (
-    "PELVIS",
-    "STOMACH",
-    "TORSO",
-    "HEAD",
-    "LEFTSHOULDER",
-    "LEFTFOREARM",
-    "LEFTHAND",
-    "RIGHTSHOULDER",
-    "RIGHTFOREARM",
-    "RIGHTHAND",
-    "LEFTTHIGH",
-    "LEFTSHIN",
-    "LEFTFOOT",
-    "RIGHTTHIGH",
-    "RIGHTSHIN",
-    "RIGHTFOOT",
-)
-bone_linkages = (0, 0, 1, 2, 2, 4, 5, 2, 7, 8, 0, 10, 11, 0, 13, 14)
-bone_dict = {key: idx for idx, key in enumerate(bone_names)}
-
-
-# Taken from https://github.com/OpenSAGE/OpenSAGE.BlenderPlugin
-def split_multi_uv_vertices(
-    context: bpy.types.Context, mesh: bpy.types.Mesh, b_mesh: bmesh.types.BMesh
+import numpy as np
+import os
+from functools import partial
+from typing import Iterable
+from . import codec, fingerprint, modal
+from .skeleton import Skeleton, bone_offsets, skin_weights, standard_skeleton
+
+
+def bone_table(
+    armature: bpy.types.Armature, skeleton: Skeleton
+) -> tuple[np.ndarray, np.ndarray]:
+    # Armature-space head of every skeleton bone, looked up once per export,
+    # and which of the bones the armature actually has
+    positions = np.zeros((len(skeleton), 3), np.float32)
+    present = np.zeros(len(skeleton), bool)
+    for index, name in enumerate(skeleton.names):
+        bone = armature.bones.get(name)
+        if bone is not None:
+            positions[index] = bone.matrix_local.to_translation()
+            present[index] = True
+    return positions, present
+
+
+def vertex_group_pairs(
+    obj: bpy.types.Object, mesh: bpy.types.Mesh, skeleton: Skeleton
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Every vertex group membership as (vertex, skeleton bone, weight);
+    # groups that are not bones of the skeleton get bone -1
+    group_bones = np.array(
+        [skeleton.indices.get(group.name, -1) for group in obj.vertex_groups],
+        np.int64,
+    )
+    vertex_groups = [vert.groups for vert in mesh.vertices]
+    group_counts = [len(groups) for groups in vertex_groups]
+    pairs = np.array(
+        [(group.group, group.weight) for groups in vertex_groups for group in groups],
+        np.float64,
+    ).reshape(-1, 2)
+    pair_vertices = np.repeat(np.arange(len(vertex_groups)), group_counts)
+    pair_bones = group_bones[pairs[:, 0].astype(np.int64)]
+    pair_weights = pairs[:, 1].astype(np.float32)
+    return pair_vertices, pair_bones, pair_weights
+
+
+def write(filepath: str, cmc_bones, cmc_verts, cmc_weights, cmc_uvs, cmc_faces):
+    sections = codec.encode_cmc(cmc_bones, cmc_verts, cmc_weights, cmc_uvs, cmc_faces)
+    with open(filepath, "wb") as f:
+        for section in sections:
+            f.write(section)
+
+
+def export_object(
+    depsgraph: bpy.types.Depsgraph,
+    ob: bpy.types.Object,
+    filepath: str,
+    skeleton: Skeleton,
+    bone_tables: dict[int, tuple[np.ndarray, np.ndarray]],
+    progress: tuple[int, int] = (1, 2),
+    block: bool = True,
+    skip_unchanged: bool = False,
 ):
-    b_mesh.verts.ensure_lookup_table()
-
-    for ver in b_mesh.verts:
-        ver.select_set(False)
+    # bone_tables maps armature data to its bone_table, so characters
+    # sharing an armature only look its bones up once
+    ob_for_convert: bpy.types.Object = ob.evaluated_get(depsgraph)
+    if ob_for_convert is None:
+        return [True, "Select a mesh with an armature as its parent"]
 
-    for i, uv_layer in enumerate(mesh.uv_layers):
-        tx_coords = [None] * len(uv_layer.data)
-        for j, face in enumerate(b_mesh.faces):
-            for loop in face.loops:
-                vert_index = mesh.polygons[j].vertices[loop.index % 3]
-                if tx_coords[vert_index] is None:
-                    tx_coords[vert_index] = uv_layer.data[loop.index].uv
-                elif tx_coords[vert_index] != uv_layer.data[loop.index].uv:
-                    b_mesh.verts[vert_index].select_set(True)
-                    vert_index2 = mesh.polygons[j].vertices[(loop.index + 1) % 3]
-                    b_mesh.verts[vert_index2].select_set(True)
-                    vert_index3 = mesh.polygons[j].vertices[(loop.index - 1) % 3]
-                    b_mesh.verts[vert_index3].select_set(True)
+    parent_armature: bpy.types.Object = ob.parent
+    if parent_armature is None or parent_armature.type != "ARMATURE":
+        return [True, "Select a mesh with an armature as its parent"]
+    parent_armature_data: bpy.types.Armature = parent_armature.data
 
-    split_edges = [e for e in b_mesh.edges if e.verts[0].select and e.verts[1].select]
+    me: bpy.types.Mesh = ob_for_convert.data
+    if me.id_type != "MESH":
+        return [True, "Select a mesh with an armature as its parent"]
 
-    if len(split_edges) > 0:
-        bmesh.ops.split_edges(b_mesh, edges=split_edges)
+    # Everything is read from the evaluated mesh's triangulation in bulk;
+    # nothing is written back into Blender data.
+    positions = np.empty((len(me.vertices), 3), np.float32)
+    me.vertices.foreach_get("co", positions.ravel())
+    loop_vertices = np.empty(len(me.loops), np.int32)
+    me.loops.foreach_get("vertex_index", loop_vertices)
+    loop_uvs = np.zeros((len(me.loops), 2), np.float32)
+    if me.uv_layers.active is not None:
+        me.uv_layers.active.uv.foreach_get("vector", loop_uvs.ravel())
+
+    triangle_loops = np.empty(len(me.loop_triangles) * 3, np.int32)
+    me.loop_triangles.foreach_get("loops", triangle_loops)
+
+    armature_key = parent_armature_data.as_pointer()
+    if armature_key not in bone_tables:
+        bone_tables[armature_key] = bone_table(parent_armature_data, skeleton)
+    bone_positions, bones_present = bone_tables[armature_key]
+    group_pairs = ()
+    if bones_present[0]:
+        group_pairs = vertex_group_pairs(ob_for_convert, me, skeleton)
+
+    # Everything the file is derived from, so an unchanged object can be
+    # skipped before any of the encoding work
+    content = fingerprint.Fingerprint("cmc/" + "/".join(skeleton.names))
+    content.update(positions, loop_vertices, loop_uvs, triangle_loops)
+    content.update(bone_positions, bones_present, *group_pairs)
+    digest = content.hexdigest()
+    if skip_unchanged and fingerprint.is_unchanged(ob, filepath, digest):
+        return [False, f"{ob.name} is unchanged, skipped writing it"]
+
+    source_vertices, cmc_uvs, loop_remap = codec.split_uv_seams(
+        loop_vertices[triangle_loops], loop_uvs[triangle_loops]
+    )
+    cmc_verts = positions[source_vertices]
+    cmc_faces = loop_remap.reshape(-1, 3)
+
+    if bones_present[0]:
+        cmc_bones = bone_offsets(skeleton, bone_positions, bones_present)
+        # Seam vertices carry the weights of the vertex they were split from
+        cmc_weights = skin_weights(
+            skeleton, positions, group_pairs, bone_positions, bones_present
+        )[source_vertices]
+    else:
+        # Without a pelvis there is no skeleton to write
+        cmc_bones = np.zeros((0, 3), np.float32)
+        cmc_weights = np.zeros((len(cmc_verts), 0, 4), np.float32)
+
+    yield progress
+    yield from modal.write_file(
+        filepath,
+        partial(
+            write,
+            cmc_bones=cmc_bones,
+            cmc_verts=cmc_verts,
+            cmc_weights=cmc_weights,
+            cmc_uvs=cmc_uvs,
+            cmc_faces=cmc_faces,
+        ),
+        progress,
+        block,
+    )
+    fingerprint.remember(ob, filepath, digest)
 
-    return b_mesh
+    return [False, None]
 
 
-def save(context: bpy.types.Context, filepath: str):
+def save_steps(
+    context: bpy.types.Context,
+    filepath: str,
+    skeleton: Skeleton = standard_skeleton,
+    block: bool = True,
+    skip_unchanged: bool = False,
+):
     # Exit edit mode before exporting,
     # so current object states are exported properly.
     bpy.ops.object.mode_set(mode="OBJECT")
@@ -66,167 +157,109 @@ def save(context: bpy.types.Context, filepath: str):
     if ob is None or ob.type != "MESH":
         return [True, "Select a mesh with an armature as its parent"]
 
-    ob_for_convert: bpy.types.Object = ob.evaluated_get(depsgraph)
-    if ob_for_convert is None:
-        return [True, "Select a mesh with an armature as its parent"]
+    return (
+        yield from export_object(
+            depsgraph, ob, filepath, skeleton, {}, (1, 2), block, skip_unchanged
+        )
+    )
 
-    parent_armature: bpy.types.Object = ob.parent
-    if parent_armature is None or parent_armature.type != "ARMATURE":
-        return [True, "Select a mesh with an armature as its parent"]
-    if parent_armature.type != "ARMATURE":
-        return [True, "Select a mesh with an armature as its parent"]
-    parent_armature_data: bpy.types.Armature = parent_armature.data
 
-    me: bpy.types.Mesh = ob_for_convert.data
-    if me.id_type != "MESH":
-        return [True, "Select a mesh with an armature as its parent"]
+def character_objects(objects: Iterable[bpy.types.Object]) -> list[bpy.types.Object]:
+    return [
+        ob
+        for ob in objects
+        if ob.type == "MESH"
+        and ob.parent is not None
+        and ob.parent.type == "ARMATURE"
+    ]
 
-    with open(filepath, "wb") as f:
-        # Magic number
-        f.write(b"CMod")
-        # Version
-        f.write(pack("<i", 2))
-
-        cmc_verts = []
-        cmc_uvs = []
-        cmc_faces = []
-        cmc_weights = []
-        cmc_bones = []
-
-        bm = bmesh.new()
-        bm.from_mesh(me)
-        bmesh.ops.triangulate(bm, faces=bm.faces)
-        bm.to_mesh(me)
-        me.update()
-
-        bm = bmesh.new()
-        bm.from_mesh(me)
-        bm = split_multi_uv_vertices(context, me, bm)
-        bm.to_mesh(me)
-        me.update()
-
-        uv_layer = bm.loops.layers.uv.verify()
-
-        for vertex in bm.verts:
-            cmc_verts.append(vertex.co[:])
-            loops = vertex.link_loops
-            if len(loops) > 0:
-                uv_data = loops[0][uv_layer]
-                cmc_uvs.append(uv_data.uv[:])
-            else:
-                cmc_uvs.append((0.0, 0.0))
-
-        for face in bm.faces:
-            cmc_faces.append(
-                (
-                    face.verts[0].index,
-                    face.verts[1].index,
-                    face.verts[2].index,
-                )
-            )
-
-        bm.free()
-
-        pelvisBone: bpy.types.Bone = parent_armature_data.bones.get(bone_names[0])
-        if pelvisBone is not None:
-            cmc_bones.append([0.0, 0.0, 0.0])
-            for boneIndex in range(1, 16):
-                boneObject: bpy.types.Bone = parent_armature_data.bones.get(
-                    bone_names[boneIndex]
-                )
-                lastBoneObject: bpy.types.Bone = parent_armature_data.bones.get(
-                    bone_names[bone_linkages[boneIndex]]
-                )
-                if (boneObject is None) or (lastBoneObject is None):
-                    continue
-
-                boneTransform: mathutils.Matrix = boneObject.matrix_local
-                lastBoneTransform: mathutils.Matrix = lastBoneObject.matrix_local
-                boneOffset: mathutils.Vector = (
-                    boneTransform.to_translation() - lastBoneTransform.to_translation()
-                ) / 1.125
-
-                cmc_bones.append(boneOffset[:])
-
-            for vert in me.vertices:
-                vert: bpy.types.MeshVertex
-                weightIndices: list[int] = [0] * 4
-                weightValues: list[float] = [1.0, 0.0, 0.0, 0.0]
-                finalWeightData = []
-
-                groupCount = 0
-                for group in vert.groups:
-                    group: bpy.types.VertexGroupElement
-                    if groupCount >= 4:
-                        break
-                    if group.weight <= 0.0:
-                        continue
-
-                    realGroup: bpy.types.VertexGroup = ob_for_convert.vertex_groups[
-                        group.group
-                    ]
-                    realGroupName: str = realGroup.name
-                    realGroupIndex: int = bone_dict.get(realGroupName)
-                    if realGroupIndex is None:
-                        continue
-
-                    weightIndices[groupCount] = realGroupIndex
-                    weightValues[groupCount] = group.weight
-
-                    groupCount += 1
-
-                for index in range(16):
-                    usingIndice = None
-                    try:
-                        usingIndice = weightIndices.index(index)
-                    except ValueError:
-                        finalWeightData.append([0.0] * 4)
-                        continue
-
-                    usingWeight = weightValues[usingIndice]
-                    if usingWeight <= 0.0:
-                        finalWeightData.append([0.0] * 4)
-                        continue
-
-                    boneObject: bpy.types.Bone = parent_armature_data.bones.get(
-                        bone_names[index]
-                    )
-                    if boneObject is None:
-                        finalWeightData.append([0.0, 0.0, 0.0, usingWeight])
-                        continue
-
-                    boneTransform: mathutils.Vector = (
-                        boneObject.matrix_local.to_translation()
-                    )
-                    boneOffset: mathutils.Vector = (vert.co - boneTransform) / 1.125
-
-                    # If there is no loaded weights, offset will be 0
-                    if groupCount <= 0:
-                        boneOffset = mathutils.Vector()
-
-                    finalWeightData.append(
-                        [boneOffset.x, boneOffset.y, boneOffset.z, usingWeight]
-                    )
-
-                cmc_weights.append(finalWeightData)
-
-        f.write(pack("<i", len(cmc_bones)))
-        for bone in cmc_bones:
-            x, z, y = bone
-            f.write(pack("<fff", x, y, z))
-
-        f.write(pack("<i", len(cmc_verts)))
-        for i in range(len(cmc_verts)):
-            x, z, y = cmc_verts[i]
-            f.write(pack("<fff", x, y, z))
-            for weight in cmc_weights[i]:
-                xw, zw, yw, w = weight
-                f.write(pack("<ffff", xw, yw, zw, w))
-            u, v = cmc_uvs[i]
-            f.write(pack("<ff", u, v))
-
-        f.write(pack("<i", len(cmc_faces)))
-        for face in cmc_faces:
-            f.write(pack("<iii", *face))
 
-    return [False, None]
+# Characters that cannot be part of a file name on any platform
+unsafe_filename_chars = str.maketrans(dict.fromkeys('<>:"/\\|?*', "_"))
+
+
+def character_filename(pattern: str, ob: bpy.types.Object) -> str:
+    # {name} is the mesh object's name, {armature} its parent's
+    filename = pattern.format(name=ob.name, armature=ob.parent.name)
+    return bpy.path.ensure_ext(filename.translate(unsafe_filename_chars), ".cmc")
+
+
+def save_all_steps(
+    context: bpy.types.Context,
+    directory: str,
+    filename_pattern: str = "{name}",
+    selected_only: bool = False,
+    skeleton: Skeleton = standard_skeleton,
+    block: bool = True,
+    skip_unchanged: bool = False,
+):
+    # Writes every mesh parented to an armature to its own file. Returns the
+    # number of files written, the number skipped as unchanged, and why the
+    # others could not be written.
+    if context.mode != "OBJECT":
+        bpy.ops.object.mode_set(mode="OBJECT")
+
+    objects = context.selected_objects if selected_only else context.scene.objects
+    characters = character_objects(objects)
+
+    # Evaluated once for all characters, and each armature's bones are only
+    # looked up for the first character using it
+    depsgraph = context.evaluated_depsgraph_get()
+    bone_tables: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+
+    targets: set[str] = set()
+    exported = 0
+    skipped = 0
+    failures: list[str] = []
+    for index, ob in enumerate(characters):
+        try:
+            filename = character_filename(filename_pattern, ob)
+        except (KeyError, IndexError, ValueError) as error:
+            failures.append(f"{ob.name}: invalid file name pattern ({error})")
+            continue
+
+        filepath = os.path.join(directory, filename)
+        target = os.path.normcase(os.path.abspath(filepath))
+        if target in targets:
+            failures.append(f"{ob.name}: another character uses {filename}")
+            continue
+        targets.add(target)
+
+        didError, message = yield from export_object(
+            depsgraph,
+            ob,
+            filepath,
+            skeleton,
+            bone_tables,
+            (index, len(characters)),
+            block,
+            skip_unchanged,
+        )
+        if didError:
+            failures.append(f"{ob.name}: {message}")
+        elif message:
+            skipped += 1
+        else:
+            exported += 1
+
+    return exported, skipped, failures
+
+
+def save(
+    context: bpy.types.Context,
+    filepath: str,
+    skeleton: Skeleton = standard_skeleton,
+):
+    return modal.drain(save_steps(context, filepath, skeleton))
+
+
+def save_all(
+    context: bpy.types.Context,
+    directory: str,
+    filename_pattern: str = "{name}",
+    selected_only: bool = False,
+    skeleton: Skeleton = standard_skeleton,
+):
+    return modal.drain(
+        save_all_steps(context, directory, filename_pattern, selected_only, skeleton)
+    )
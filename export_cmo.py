@@ -1,76 +1,297 @@
 import bpy
-import bmesh
+import numpy as np
+import os
+import shutil
+import tempfile
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from struct import pack
+from typing import NamedTuple, Optional
+from . import codec, fingerprint, modal
 
 
-def save(context: bpy.types.Context, filepath: str):
-    with open(filepath, "wb") as f:
-        # Magic number
-        f.write(b"CMod")
-        # Version
-        f.write(pack("<i", 3))
+class MeshArrays(NamedTuple):
+    # Raw local-space arrays of one mesh, as read from Blender
+    vertices: np.ndarray
+    loop_vertices: np.ndarray
+    loop_uvs: Optional[np.ndarray]
+    triangle_loops: np.ndarray
+
+
+class LocalMesh(NamedTuple):
+    # One UV per vertex (from its first loop) and triangles, still in
+    # local space so instances of the same mesh can share them
+    vertices: np.ndarray
+    uvs: np.ndarray
+    faces: np.ndarray
 
-        depsgraph = context.evaluated_depsgraph_get()
-        scene = context.scene
 
-        # Exit edit mode before exporting,
-        # so current object states are exported properly.
-        bpy.ops.object.mode_set(mode="OBJECT")
+# Modifiers whose result only depends on the mesh and their own settings.
+# Anything else (Geometry Nodes, whose inputs and Object Info nodes are not
+# covered by the settings below, armatures, hooks, ...) can evaluate
+# differently per object.
+shareable_modifiers = {
+    "ARRAY",
+    "BEVEL",
+    "BUILD",
+    "CORRECTIVE_SMOOTH",
+    "DECIMATE",
+    "EDGE_SPLIT",
+    "LAPLACIANSMOOTH",
+    "MIRROR",
+    "MULTIRES",
+    "REMESH",
+    "SCREW",
+    "SKIN",
+    "SMOOTH",
+    "SOLIDIFY",
+    "SUBSURF",
+    "TRIANGULATE",
+    "WELD",
+    "WEIGHTED_NORMAL",
+    "WIREFRAME",
+}
 
-        cmo_verts = []
-        cmo_uvs = []
-        cmo_faces = []
 
-        for ob in scene.objects:
-            ob_for_convert = ob.evaluated_get(depsgraph)
+# Modifier properties that are per-object UI or identity state and do not
+# change the evaluated mesh (show_viewport is checked on its own)
+ignored_modifier_properties = {
+    "name",
+    "show_expanded",
+    "show_viewport",
+    "show_render",
+    "show_in_editmode",
+    "show_on_cage",
+    "is_active",
+    "use_pin_to_last",
+    "use_apply_on_spline",
+}
 
-            try:
-                me = ob_for_convert.to_mesh()
-            except RuntimeError:
-                me = None
 
-            if me is None:
+def instance_key(ob: bpy.types.Object) -> Optional[tuple]:
+    # Objects evaluating to the same local-space mesh share one key: the
+    # same mesh data with the same modifier settings. Objects that may
+    # evaluate differently from other users of their mesh get no key.
+    if ob.type != "MESH":
+        return None
+    # Mesh data used by a single object has nothing to share
+    if ob.data.users <= 1:
+        return None
+    # Armature and lattice parents deform like a modifier would
+    if ob.parent is not None and ob.parent_type != "OBJECT":
+        return None
+
+    signature = []
+    for modifier in ob.modifiers:
+        if not modifier.show_viewport:
+            continue
+        if modifier.type not in shareable_modifiers:
+            return None
+        values = [modifier.type]
+        for prop in modifier.bl_rna.properties:
+            if (
+                prop.is_readonly
+                or prop.type == "COLLECTION"
+                or prop.identifier in ignored_modifier_properties
+            ):
                 continue
+            value = getattr(modifier, prop.identifier)
+            if prop.type == "POINTER":
+                # e.g. a mirror or array offset object, whose transform
+                # changes the result
+                if isinstance(value, (bpy.types.Object, bpy.types.Collection)):
+                    return None
+                value = None if value is None else value.as_pointer()
+            elif isinstance(value, set):
+                # Enum flags, e.g. a Decimate modifier's delimit
+                value = tuple(sorted(value))
+            elif getattr(prop, "is_array", False):
+                value = tuple(value)
+            values.append(value)
+        signature.append(tuple(values))
+
+    return ob.data.as_pointer(), tuple(signature)
+
+
+def extract(ob_for_convert: bpy.types.Object) -> Optional[MeshArrays]:
+    # Reads one object in bulk from a temporary mesh that is freed again
+    # right away. This is the only part that has to run on the main thread.
+    try:
+        me = ob_for_convert.to_mesh()
+    except RuntimeError:
+        return None
+    if me is None:
+        return None
+
+    try:
+        vertices = np.empty((len(me.vertices), 3), np.float32)
+        me.vertices.foreach_get("co", vertices.ravel())
+        loop_vertices = np.empty(len(me.loops), np.int32)
+        me.loops.foreach_get("vertex_index", loop_vertices)
+        loop_uvs = None
+        if me.uv_layers.active is not None:
+            loop_uvs = np.empty((len(me.loops), 2), np.float32)
+            me.uv_layers.active.uv.foreach_get("vector", loop_uvs.ravel())
+        triangle_loops = np.empty(len(me.loop_triangles) * 3, np.int32)
+        me.loop_triangles.foreach_get("loops", triangle_loops)
+    finally:
+        ob_for_convert.to_mesh_clear()
+
+    return MeshArrays(vertices, loop_vertices, loop_uvs, triangle_loops)
+
+
+def prepare(arrays: MeshArrays) -> LocalMesh:
+    uvs = np.zeros((len(arrays.vertices), 2), np.float32)
+    if arrays.loop_uvs is not None:
+        used_vertices, first_loops = np.unique(
+            arrays.loop_vertices, return_index=True
+        )
+        uvs[used_vertices] = arrays.loop_uvs[first_loops]
+
+    faces = arrays.loop_vertices[arrays.triangle_loops].reshape(-1, 3)
+    return LocalMesh(arrays.vertices, uvs, faces)
 
-            bm = bmesh.new()
-            bm.from_mesh(me)
-            bmesh.ops.triangulate(bm, faces=bm.faces)
 
-            uv_layer = bm.loops.layers.uv.verify()
+def encode(
+    local_mesh: Future, matrix: np.ndarray, vertex_offset: int
+) -> tuple[np.ndarray, np.ndarray]:
+    # World-space vertex records, and face records indexing into the whole
+    # file's vertices. The local mesh was submitted to the pool before this
+    # task, so it has already been picked up by a worker.
+    vertices, uvs, faces = local_mesh.result()
+    vertices = vertices @ matrix[:3, :3].T + matrix[:3, 3]
+    return (
+        codec.cmo_vertex_records(vertices, uvs),
+        codec.cmo_face_records(faces + vertex_offset),
+    )
 
-            for vertex in bm.verts:
-                cmo_verts.append(vertex.co[:])
-                loops = vertex.link_loops
-                if len(loops) > 0:
-                    uv_data = loops[0][uv_layer]
-                    cmo_uvs.append(uv_data.uv[:])
+
+def save_steps(
+    context: bpy.types.Context,
+    filepath: str,
+    block: bool = True,
+    skip_unchanged: bool = False,
+):
+    depsgraph = context.evaluated_depsgraph_get()
+    scene = context.scene
+
+    # Exit edit mode before exporting,
+    # so current object states are exported properly.
+    bpy.ops.object.mode_set(mode="OBJECT")
+
+    objects = list(scene.objects)
+    # The last step is finishing the file
+    step_count = len(objects) + 1
+
+    # The main thread extracts each object's arrays and a thread pool
+    # encodes them, while finished objects are written in scene order. At
+    # most `pending_limit` objects are in flight at once. Vertices are
+    # written straight away. Faces come after all vertices in the file, so
+    # they are spooled to a temporary file meanwhile, and the vertex count
+    # is patched in at the end.
+    workers = os.cpu_count() or 1
+    pending_limit = workers * 2
+    pending: deque[Future] = deque()
+    # Instance key -> (local mesh, vertex count, face count, mesh number),
+    # so each shared mesh is only extracted and triangulated once. Entries
+    # are dropped once their last instance is submitted, so only meshes
+    # with instances still to come stay in memory.
+    keys = [instance_key(ob) for ob in objects]
+    instances_left = Counter(key for key in keys if key is not None)
+    local_meshes: dict[tuple, tuple[Future, int, int, int]] = {}
+    mesh_count = 0
+    vertex_count = 0
+    face_count = 0
+    # Built up alongside the export; if it matches the last export to the
+    # same file, what was written is dropped and the file left untouched
+    content = fingerprint.Fingerprint("cmo")
+    unchanged = False
+
+    with modal.replace_file(filepath) as f, tempfile.TemporaryFile(
+        dir=os.path.dirname(filepath) or None
+    ) as face_spool:
+        f.write(codec.cmo_header(0))
+
+        def write_next(progress: tuple[int, int]):
+            vertex_records, face_records = yield from modal.wait_for(
+                pending[0], progress, block
+            )
+            pending.popleft()
+            f.write(vertex_records)
+            face_spool.write(face_records)
+
+        def finish():
+            f.write(pack("<i", face_count))
+            face_spool.seek(0)
+            shutil.copyfileobj(face_spool, f, 1 << 20)
+            # The vertex count follows the magic number and version
+            f.seek(8)
+            f.write(pack("<i", vertex_count))
+
+        pool = ThreadPoolExecutor(workers)
+        try:
+            for index, ob in enumerate(objects):
+                ob_for_convert = ob.evaluated_get(depsgraph)
+                key = keys[index]
+                local_mesh = local_meshes.get(key) if key is not None else None
+                if local_mesh is None:
+                    arrays = extract(ob_for_convert)
+                    if arrays is not None:
+                        content.update(*(a for a in arrays if a is not None))
+                        local_mesh = (
+                            pool.submit(prepare, arrays),
+                            len(arrays.vertices),
+                            len(arrays.triangle_loops) // 3,
+                            mesh_count,
+                        )
+                        mesh_count += 1
+                        if key is not None:
+                            local_meshes[key] = local_mesh
                 else:
-                    cmo_uvs.append((0.0, 0.0))
+                    # Instances hash as a reference to the first one
+                    content.update(np.array([local_mesh[3]]))
+
+                if local_mesh is not None:
+                    future, mesh_vertex_count, mesh_face_count, _ = local_mesh
+                    matrix = np.array(ob_for_convert.matrix_world, np.float32)
+                    content.update(matrix)
+                    pending.append(pool.submit(encode, future, matrix, vertex_count))
+                    vertex_count += mesh_vertex_count
+                    face_count += mesh_face_count
 
-            for face in bm.faces:
-                cmo_faces.append(
-                    (
-                        face.verts[0].index,
-                        face.verts[1].index,
-                        face.verts[2].index,
-                    )
-                )
+                if key is not None:
+                    instances_left[key] -= 1
+                    if not instances_left[key]:
+                        local_meshes.pop(key, None)
 
-            bm.free()
+                while pending and (
+                    pending[0].done() or len(pending) >= pending_limit
+                ):
+                    yield from write_next((index, step_count))
+                yield index + 1, step_count
 
-        f.write(pack("<i", len(cmo_verts)))
+            while pending:
+                yield from write_next((len(objects), step_count))
 
-        for i in range(len(cmo_verts)):
-            x, z, y = cmo_verts[i]
-            f.write(pack("<fff", x, y, z))
-            u, v = cmo_uvs[i]
-            f.write(pack("<fff", u, v, 0.0))
+            digest = content.hexdigest()
+            if skip_unchanged and fingerprint.is_unchanged(scene, filepath, digest):
+                unchanged = True
+                raise modal.KeepExisting()
 
-        f.write(pack("<i", len(cmo_faces)))
+            yield from modal.wait_for(
+                pool.submit(finish), (step_count - 1, step_count), block
+            )
+        finally:
+            # Lets a running task finish before the files are closed
+            pool.shutdown(cancel_futures=True)
 
-        for face in cmo_faces:
-            f.write(pack("<i", 3))
-            f.write(pack("<iii", *face))
-            f.write(pack("<ii", 0, 0))
+    if unchanged:
+        return f"{scene.name} is unchanged, skipped writing it"
+    fingerprint.remember(scene, filepath, digest)
+    return None
+
+
+def save(context: bpy.types.Context, filepath: str):
+    modal.drain(save_steps(context, filepath))
 
     return {"FINISHED"}
@@ -0,0 +1,57 @@
+import bpy
+import hashlib
+import numpy as np
+import os
+
+# Bump whenever the exporters write something different for the same data,
+# so files from older versions are written again
+export_version = 2
+
+
+class Fingerprint:
+    """Hash of the data going into an exported file"""
+
+    def __init__(self, kind: str):
+        self._hash = hashlib.blake2b(digest_size=20)
+        self._hash.update(f"{kind}-{export_version}".encode())
+
+    def update(self, *arrays):
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            # Shape and type are part of the data, or differently laid out
+            # arrays with the same bytes would collide
+            self._hash.update(f"{array.dtype.str}{array.shape}".encode())
+            self._hash.update(array)
+
+    def hexdigest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def is_unchanged(owner: bpy.types.ID, filepath: str, fingerprint: str) -> bool:
+    # The file must also be exactly as it was written, so replaced or
+    # edited files are written again
+    record = owner.get("subrosa_export")
+    if record is None:
+        return False
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return False
+
+    return (
+        record.get("filepath") == os.path.abspath(filepath)
+        and record.get("fingerprint") == fingerprint
+        and record.get("size") == str(stat.st_size)
+        and record.get("mtime") == str(stat.st_mtime_ns)
+    )
+
+
+def remember(owner: bpy.types.ID, filepath: str, fingerprint: str):
+    # Size and time are stored as strings, ID properties only hold 32-bit ints
+    stat = os.stat(filepath)
+    owner["subrosa_export"] = {
+        "filepath": os.path.abspath(filepath),
+        "fingerprint": fingerprint,
+        "size": str(stat.st_size),
+        "mtime": str(stat.st_mtime_ns),
+    }
@@ -0,0 +1,149 @@
+import bpy
+import os
+from types import ModuleType
+from typing import Optional
+from . import cache, shared
+
+# Bump whenever the objects built on import change, so stale models are
+# rebuilt instead of appended
+library_version = 2
+
+
+class ModelLibrary:
+    """Directory of .blend files holding already built models, keyed by the
+    content of the file they were imported from"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self, importer: ModuleType, digest: str) -> str:
+        # The same file builds differently depending on the importer (e.g.
+        # standard vs legacy CMC), so the importer is part of the key
+        return f"{importer_kind(importer)}-{library_version}-{digest}"
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".blend")
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def save(self, key: str, objects: list[bpy.types.Object]):
+        # Written to a temporary file first, so a failed write never leaves
+        # a truncated model behind
+        path = self.path(key)
+        temp_path = path + ".tmp"
+        try:
+            bpy.data.libraries.write(
+                temp_path, set(objects), path_remap="NONE", fake_user=True
+            )
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def load(
+        self,
+        session: shared.ImportSession,
+        key: str,
+        name: str,
+        share_armature: bool = False,
+        share_mesh: bool = False,
+    ) -> bool:
+        try:
+            with bpy.data.libraries.load(self.path(key)) as (data_from, data_to):
+                data_to.objects = data_from.objects
+        except OSError:
+            return False
+
+        for obj in data_to.objects:
+            obj.use_fake_user = False
+            if "subrosa_part" in obj:
+                obj.name = name + obj["subrosa_part"]
+                obj.data.name = obj.name
+
+            mesh = obj.data
+            if isinstance(mesh, bpy.types.Mesh) and "subrosa_mesh" in mesh:
+                mesh_key = mesh["subrosa_mesh"]
+                existing = session.find_mesh(mesh_key) if share_mesh else None
+                if existing is not None and existing != mesh:
+                    obj.data = existing
+                    bpy.data.meshes.remove(mesh)
+                else:
+                    session.add_mesh(mesh_key, mesh)
+
+            armature = obj.data
+            if share_armature and isinstance(armature, bpy.types.Armature):
+                existing = shared.find_armature(
+                    armature["subrosa_bones"], exclude=armature
+                )
+                if existing is not None:
+                    obj.data = existing
+                    bpy.data.armatures.remove(armature)
+
+            session.add(obj)
+
+        return True
+
+
+def importer_kind(importer: ModuleType) -> str:
+    return importer.__name__.rpartition(".")[2]
+
+
+active_library: Optional[ModelLibrary] = None
+
+
+def configure(directory: Optional[str]):
+    global active_library
+    if directory is None:
+        active_library = None
+    elif active_library is None or active_library.directory != directory:
+        active_library = ModelLibrary(directory)
+
+
+def prepare(importer: ModuleType, filepath: str):
+    # Runs on worker threads: models already in the library are not parsed
+    digest = cache.file_digest(filepath)
+    model_library = active_library
+    if model_library is not None:
+        if model_library.key(importer, digest) in model_library:
+            return digest, None
+    return digest, importer.parse(filepath)
+
+
+def build(
+    session: shared.ImportSession,
+    importer: ModuleType,
+    filepath: str,
+    name: str,
+    prepared: tuple[str, object],
+    **keywords,
+):
+    digest, decoded = prepared
+    model_library = active_library
+    key = None if model_library is None else model_library.key(importer, digest)
+    first = len(session.objects)
+
+    loaded = False
+    if decoded is None and model_library is not None:
+        loaded = model_library.load(
+            session,
+            key,
+            name,
+            keywords.get("share_armature", False),
+            keywords.get("share_mesh", False),
+        )
+
+    if not loaded:
+        if decoded is None:
+            decoded = importer.parse(filepath)
+        importer.build(session, name, decoded, **keywords)
+        if model_library is not None:
+            model_library.save(key, session.objects[first:])
+
+    # Remember where each object came from, so it can be reloaded when the
+    # file changes
+    for obj in session.objects[first:]:
+        if "subrosa_part" in obj:
+            obj["subrosa_source"] = os.path.abspath(filepath)
+            obj["subrosa_hash"] = digest
+            obj["subrosa_format"] = importer_kind(importer)
@@ -0,0 +1,167 @@
+import bpy
+import os
+import time
+from bpy.props import BoolProperty
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Generator
+
+# A task is a generator that does one slice of Blender-side work per step and
+# yields (done, total) progress. Heavy file work runs on worker threads that
+# the task polls, so a task never blocks the UI unless it is told to.
+Task = Generator[tuple[int, int], None, object]
+
+
+def drain(task: Task):
+    while True:
+        try:
+            next(task)
+        except StopIteration as stop:
+            return stop.value
+
+
+def wait_for(future: Future, progress: tuple[int, int], block: bool = True):
+    while not (block or future.done()):
+        yield progress
+    return future.result()
+
+
+def write_file(
+    filepath: str,
+    write: Callable[[str], None],
+    progress: tuple[int, int],
+    block: bool = True,
+):
+    # Encode and write on a worker thread into a temporary file, which only
+    # replaces the target once complete; a cancelled task leaves no file.
+    temp_filepath = filepath + ".tmp"
+    with ThreadPoolExecutor(1) as pool:
+        future = pool.submit(write, temp_filepath)
+        try:
+            yield from wait_for(future, progress, block)
+        except BaseException:
+            wait((future,))
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+
+    os.replace(temp_filepath, filepath)
+
+
+class KeepExisting(Exception):
+    """Raised inside replace_file to drop what was written and leave the
+    existing file as it is"""
+
+
+@contextmanager
+def replace_file(filepath: str):
+    # Like write_file, for tasks that write as they go: the target is only
+    # replaced once the block completes.
+    temp_filepath = filepath + ".tmp"
+    try:
+        with open(temp_filepath, "wb") as f:
+            yield f
+    except BaseException as error:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        if isinstance(error, KeepExisting):
+            return
+        raise
+
+    os.replace(temp_filepath, filepath)
+
+
+# Events that only move the view, let through while a task runs
+passthrough_events = {
+    "MOUSEMOVE",
+    "INBETWEEN_MOUSEMOVE",
+    "MIDDLEMOUSE",
+    "WHEELUPMOUSE",
+    "WHEELDOWNMOUSE",
+    "TRACKPADPAN",
+    "TRACKPADZOOM",
+    "MOUSEROTATE",
+    "MOUSESMARTZOOM",
+    "NDOF_MOTION",
+    "WINDOW_DEACTIVATE",
+    "TIMER_REPORT",
+}
+
+
+class ModalTask:
+    """Runs an operator's task in timer-driven slices when invoked from the UI"""
+
+    run_modal: BoolProperty(default=False, options={"HIDDEN", "SKIP_SAVE"})
+
+    # Longest stretch of Blender-side work done per timer event
+    slice_seconds = 0.05
+
+    def invoke(self, context, event):
+        self.run_modal = True
+        return super().invoke(context, event)
+
+    def run_task(self, context: bpy.types.Context, task: Task):
+        if not self.run_modal:
+            return self.finish_task(context, drain(task))
+
+        self._task = task
+        self._progress = (0, 1)
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.01, window=context.window)
+        wm.modal_handler_add(self)
+        wm.progress_begin(0, 1)
+        self.show_progress(context)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        if event.type == "ESC":
+            # Closing the generator runs its cleanup, removing anything
+            # it had created so far.
+            self._task.close()
+            self.end_task(context)
+            self.report({"WARNING"}, "Cancelled")
+            return {"CANCELLED"}
+
+        if event.type != "TIMER":
+            # Anything else could undo, delete or edit the data the task
+            # holds on to, or change the frame halfway through an export,
+            # so only viewport navigation gets through
+            if event.type in passthrough_events:
+                return {"PASS_THROUGH"}
+            return {"RUNNING_MODAL"}
+
+        deadline = time.perf_counter() + self.slice_seconds
+        try:
+            while time.perf_counter() < deadline:
+                progress = next(self._task)
+                # Waiting on a worker thread, give the UI back
+                if progress == self._progress:
+                    break
+                self._progress = progress
+        except StopIteration as stop:
+            self.end_task(context)
+            return self.finish_task(context, stop.value)
+        except Exception as error:
+            self.end_task(context)
+            self.report({"ERROR"}, str(error))
+            return {"CANCELLED"}
+
+        self.show_progress(context)
+        return {"RUNNING_MODAL"}
+
+    def show_progress(self, context: bpy.types.Context):
+        done, total = self._progress
+        context.window_manager.progress_update(done / max(total, 1))
+        context.workspace.status_text_set(
+            f"{self.bl_label}: {done}/{total} (Esc to cancel)"
+        )
+
+    def end_task(self, context: bpy.types.Context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+
+    def finish_task(self, context: bpy.types.Context, result) -> set[str]:
+        return {"FINISHED"}
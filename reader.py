@@ -0,0 +1,52 @@
+import mmap
+import os
+import traceback
+from typing import Callable, Iterator, Optional
+from . import codec
+
+
+class ModelReader:
+    """Memory-mapped, lazily decoded view of a Sub Rosa model file"""
+
+    def __init__(
+        self,
+        filepath: str,
+        layout: Optional[Callable[..., Iterator[codec.Section]]] = None,
+    ):
+        if layout is None:
+            extension = os.path.splitext(filepath)[1].lower()
+            layout = codec.layouts[extension]
+
+        with open(filepath, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.sections = codec.SectionIndex(self._map, layout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if tb is not None:
+            # The failed decode's frames may still hold views into the map
+            traceback.clear_frames(tb)
+        self.close()
+
+    def __getitem__(self, name: str):
+        return self.sections[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sections
+
+    def section(self, name: str) -> memoryview:
+        return self.sections.view(name)
+
+    def mesh(self) -> codec.DecodedMesh:
+        return codec.decode_mesh(self.sections)
+
+    def vehicle(self) -> codec.DecodedVehicle:
+        return codec.decode_vehicle(self.sections)
+
+    def close(self):
+        # Sections are views into the map, anything kept beyond this must
+        # be copied out first (see codec.detach)
+        self.sections.clear()
+        self._map.close()
@@ -0,0 +1,190 @@
+import bpy
+import importlib
+import numpy as np
+from collections import defaultdict
+from types import ModuleType
+from typing import Iterable, NamedTuple, Optional
+from . import cache, shared
+from .skeleton import Skeleton
+
+
+def changed_sources(
+    objects: Iterable[bpy.types.Object],
+    failed: dict[str, str],
+) -> dict[str, tuple[str, list[bpy.types.Object]]]:
+    # source path -> (current content hash, objects built from an older one).
+    # Files whose current content already failed to reload are left out.
+    stale: dict[str, list[bpy.types.Object]] = defaultdict(list)
+    digests: dict[str, Optional[str]] = {}
+    for obj in objects:
+        source = obj.get("subrosa_source")
+        if source is None or obj.library or obj.type != "MESH":
+            continue
+
+        if source not in digests:
+            try:
+                digests[source] = cache.file_digest(source)
+            except OSError:
+                # Missing, or still being written; try again later
+                digests[source] = None
+            if failed.get(source) == digests[source]:
+                digests[source] = None
+        digest = digests[source]
+        if digest is not None and obj.get("subrosa_hash") != digest:
+            stale[source].append(obj)
+
+    return {source: (digests[source], stale[source]) for source in stale}
+
+
+def reload_armature(
+    context: bpy.types.Context,
+    armature_object: bpy.types.Object,
+    skeleton: Skeleton,
+    bones: np.ndarray,
+):
+    # Bones that moved need new armature data, as built on import; other
+    # objects still using the old data are left as they are
+    key = shared.armature_key(skeleton, bones)
+    old_armature: bpy.types.Armature = armature_object.data
+    if old_armature.get("subrosa_bones") == key:
+        return
+
+    armature = bpy.data.armatures.new(old_armature.name)
+    armature["subrosa_bones"] = key
+    armature_object.data = armature
+    shared.build_bones(
+        context, armature_object, skeleton, skeleton.armature_positions(bones)
+    )
+    if old_armature.users == 0:
+        bpy.data.armatures.remove(old_armature)
+
+
+def reload_object(
+    context: bpy.types.Context,
+    obj: bpy.types.Object,
+    importer: ModuleType,
+    decoded: NamedTuple,
+):
+    decoded_mesh = importer.parts(decoded).get(obj.get("subrosa_part", ""))
+    if decoded_mesh is None:
+        return
+
+    # A mesh shared with other objects is replaced rather than edited, so
+    # only this object changes
+    mesh: bpy.types.Mesh = obj.data
+    if mesh.users > 1 or not shared.update_mesh(
+        mesh, decoded_mesh.vertices, decoded_mesh.polygons, decoded_mesh.vertex_uvs
+    ):
+        shared.replace_mesh(
+            obj,
+            decoded_mesh.vertices,
+            decoded_mesh.polygons,
+            decoded_mesh.vertex_uvs,
+        )
+
+    armature_object = obj.parent
+    bones = decoded_mesh.bones
+    if (
+        armature_object is None
+        or armature_object.type != "ARMATURE"
+        or bones is None
+        or not len(bones)
+    ):
+        return
+
+    skeleton = importer.skeleton
+    reload_armature(context, armature_object, skeleton, bones)
+    if decoded_mesh.vertex_weights is not None:
+        shared.skin_mesh(
+            obj,
+            decoded_mesh.vertices,
+            decoded_mesh.vertex_weights,
+            skeleton,
+            skeleton.armature_positions(bones),
+        )
+
+
+def reload_changed(
+    context: bpy.types.Context,
+    objects: Iterable[bpy.types.Object],
+    failed: Optional[dict[str, str]] = None,
+) -> tuple[int, list[tuple[str, Exception]]]:
+    # Only files whose content changed since their objects were built are
+    # parsed again. Meshes with the same topology are updated in place,
+    # anything else gets new mesh data on the same object. `failed` maps
+    # files to the content hash that last failed to reload.
+    if failed is None:
+        failed = {}
+    reloaded = 0
+    failures: list[tuple[str, Exception]] = []
+    for source, (digest, stale) in changed_sources(objects, failed).items():
+        try:
+            importer = importlib.import_module(
+                "." + stale[0]["subrosa_format"], __package__
+            )
+            decoded = importer.parse(source)
+            for obj in stale:
+                reload_object(context, obj, importer, decoded)
+                obj["subrosa_hash"] = digest
+        except Exception as error:
+            failed[source] = digest
+            failures.append((source, error))
+        else:
+            reloaded += 1
+
+    if reloaded:
+        context.view_layer.update()
+    return reloaded, failures
+
+
+watch_interval = 1.0
+# Broken files are only parsed again once they change
+_failed: dict[str, str] = {}
+# Failures not shown to the user yet, see report_failures
+_unreported: list[tuple[str, Exception]] = []
+
+
+def watch_tick() -> Optional[float]:
+    window = next(iter(bpy.context.window_manager.windows), None)
+    if window is None:
+        return watch_interval
+
+    with bpy.context.temp_override(window=window):
+        context = bpy.context
+        # Rebuilding bones leaves edit mode, and meshes written under an
+        # open edit mesh are overwritten when it closes, so wait until the
+        # user is back in object mode
+        if context.mode != "OBJECT":
+            return watch_interval
+
+        _, failures = reload_changed(context, context.scene.objects, _failed)
+        if failures:
+            _unreported.extend(failures)
+            # Timers cannot report, so an operator shows them in the status
+            # bar and info log
+            bpy.ops.import_scene.subrosa_watch_report()
+    return watch_interval
+
+
+def report_failures() -> list[tuple[str, Exception]]:
+    failures = _unreported[:]
+    _unreported.clear()
+    return failures
+
+
+def is_watching() -> bool:
+    return bpy.app.timers.is_registered(watch_tick)
+
+
+def watch(interval: float):
+    global watch_interval
+    watch_interval = interval
+    _failed.clear()
+    _unreported.clear()
+    if not is_watching():
+        bpy.app.timers.register(watch_tick, first_interval=interval)
+
+
+def unwatch():
+    if is_watching():
+        bpy.app.timers.unregister(watch_tick)
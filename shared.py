@@ -1,148 +1,472 @@
 import bpy
+import hashlib
 import mathutils
+import numpy as np
 from typing import Optional
+from .codec import Polygons, Skin, swizzle
+from .skeleton import Skeleton, armature_root, bone_scale, standard_skeleton
 
-armature_root = mathutils.Vector((0.0, 0.0625, -0.1875))
-bone_names = (
-    "PELVIS",
-    "STOMACH",
-    "TORSO",
-    "HEAD",
-    "LEFTSHOULDER",
-    "LEFTFOREARM",
-    "LEFTHAND",
-    "RIGHTSHOULDER",
-    "RIGHTFOREARM",
-    "RIGHTHAND",
-    "LEFTTHIGH",
-    "LEFTSHIN",
-    "LEFTFOOT",
-    "RIGHTTHIGH",
-    "RIGHTSHIN",
-    "RIGHTFOOT",
-)
-bone_linkages = (0, 0, 1, 2, 2, 4, 5, 2, 7, 8, 0, 10, 11, 0, 13, 14)
 
+class ImportSession:
+    """Collects the objects of one import and links them in a single pass"""
 
-def load_mesh(
-    context: bpy.types.Context,
-    name: str,
-    vertices: list[tuple[float, float, float]],
-    faces,
-    vertex_uvs,
-    vertex_weights,
-    bones: Optional[list[tuple[float, float, float]]],
-):
-    new_vertices: list[tuple[float, float, float]] = []
-    for vertex in vertices:
-        new_vertices.append((vertex[0], vertex[2], vertex[1]))
+    def __init__(self, context: bpy.types.Context, name: str):
+        self.context = context
+        self.view_layer: bpy.types.ViewLayer = context.view_layer
+        self.collection = bpy.data.collections.new(name)
+        self.view_layer.active_layer_collection.collection.children.link(
+            self.collection
+        )
+        self.objects: list[bpy.types.Object] = []
+        # Content key -> mesh, indexed on first use
+        self._meshes: Optional[dict[str, bpy.types.Mesh]] = None
+        # Keys whose mesh was checked against its content this session
+        self._verified: set[str] = set()
+
+    def find_mesh(self, key: str) -> Optional[bpy.types.Mesh]:
+        if self._meshes is None:
+            self._meshes = {
+                mesh["subrosa_mesh"]: mesh
+                for mesh in bpy.data.meshes
+                if "subrosa_mesh" in mesh and not mesh.library
+            }
+        mesh = self._meshes.get(key)
+        if mesh is None or key in self._verified:
+            return mesh
+        if current_mesh_key(mesh) != key:
+            # Edited since it was imported, so it no longer matches the file
+            del mesh["subrosa_mesh"]
+            del self._meshes[key]
+            return None
+        self._verified.add(key)
+        return mesh
+
+    def add_mesh(self, key: str, mesh: bpy.types.Mesh):
+        # Built (or appended) from the file during this session
+        mesh["subrosa_mesh"] = key
+        self._verified.add(key)
+        if self._meshes is not None:
+            self._meshes[key] = mesh
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.discard()
+
+    def add(self, obj: bpy.types.Object, link: bool = False):
+        # Objects that must be in the view layer right away (e.g. to enter
+        # edit mode) are linked immediately, everything else on finish.
+        self.objects.append(obj)
+        if link:
+            self.collection.objects.link(obj)
+
+    def finish(self):
+        # Nothing was imported (e.g. every file failed to decode), so leave
+        # no empty collection behind
+        if not self.objects:
+            self.discard()
+            return
+
+        linked = self.collection.objects
+        for obj in self.objects:
+            if obj.name not in linked:
+                linked.link(obj)
+        for obj in self.objects:
+            obj.select_set(True)
 
+        self.view_layer.update()
+
+    def discard(self, first: int = 0):
+        # Removes the objects added from `first` on, and with them the whole
+        # session when that is all of them
+        for obj in self.objects[first:]:
+            data = obj.data
+            bpy.data.objects.remove(obj)
+            if data is not None and data.users == 0:
+                if isinstance(data, bpy.types.Mesh):
+                    key = data.get("subrosa_mesh")
+                    self._verified.discard(key)
+                    if self._meshes is not None:
+                        self._meshes.pop(key, None)
+                    bpy.data.meshes.remove(data)
+                elif isinstance(data, bpy.types.Armature):
+                    bpy.data.armatures.remove(data)
+        del self.objects[first:]
+
+        if not first:
+            bpy.data.collections.remove(self.collection)
+
+
+def new_mesh(
+    name: str,
+    vertices: np.ndarray,
+    polygons: Polygons,
+    vertex_uvs: Optional[np.ndarray],
+) -> bpy.types.Mesh:
     mesh = bpy.data.meshes.new(name)
-    mesh.from_pydata(new_vertices, (), faces)
+    mesh.vertices.add(len(vertices))
+    mesh.loops.add(len(polygons.vertex_index))
+    mesh.polygons.add(len(polygons.loop_start))
 
-    if vertex_uvs:
-        layer = mesh.uv_layers.new(do_init=True)
-        for loop in mesh.loops:
-            layer.uv[loop.index].vector = mathutils.Vector(
-                vertex_uvs[loop.vertex_index]
-            )
+    mesh.vertices.foreach_set(
+        "co", np.ascontiguousarray(vertices[:, swizzle], dtype=np.float32).ravel()
+    )
+    mesh.loops.foreach_set(
+        "vertex_index", np.ascontiguousarray(polygons.vertex_index, dtype=np.int32)
+    )
+    # loop_total is derived from consecutive loop starts since Blender 3.6
+    mesh.polygons.foreach_set(
+        "loop_start", np.ascontiguousarray(polygons.loop_start, dtype=np.int32)
+    )
 
-    obj = bpy.data.objects.new(name, mesh)
+    if vertex_uvs is not None:
+        layer = mesh.uv_layers.new(do_init=False)
+        loop_uvs = vertex_uvs[polygons.vertex_index]
+        layer.uv.foreach_set(
+            "vector", np.ascontiguousarray(loop_uvs, dtype=np.float32).ravel()
+        )
 
-    armatureSpaceBonePositions = [None] * 16
-    if bones:
-        boneObjects: list[bpy.types.EditBone] = []
+    mesh.update(calc_edges=True)
+    return mesh
+
+
+def content_key(
+    vertices: np.ndarray,
+    loop_start: np.ndarray,
+    vertex_index: np.ndarray,
+    loop_uvs: Optional[np.ndarray],
+) -> str:
+    # Identifies a mesh by its content in file space, so identical meshes
+    # from different files can share one data-block
+    key = hashlib.blake2b(digest_size=20)
+    key.update(np.ascontiguousarray(vertices, dtype=np.float32))
+    key.update(np.ascontiguousarray(loop_start, dtype=np.int32))
+    key.update(np.ascontiguousarray(vertex_index, dtype=np.int32))
+    if loop_uvs is not None:
+        key.update(np.ascontiguousarray(loop_uvs, dtype=np.float32))
+    return key.hexdigest()
+
+
+def mesh_key(
+    vertices: np.ndarray,
+    polygons: Polygons,
+    vertex_uvs: Optional[np.ndarray],
+) -> str:
+    # UVs are keyed per loop, as that is all a built mesh still has
+    loop_uvs = None if vertex_uvs is None else vertex_uvs[polygons.vertex_index]
+    return content_key(vertices, polygons.loop_start, polygons.vertex_index, loop_uvs)
 
-        bpy.ops.object.armature_add(
-            enter_editmode=True, align="WORLD", location=(0, 0, 0), scale=(1, 1, 1)
+
+def current_mesh_key(mesh: bpy.types.Mesh) -> str:
+    # The key of what the mesh holds now, read back the way new_mesh wrote it
+    vertices = np.empty((len(mesh.vertices), 3), np.float32)
+    mesh.vertices.foreach_get("co", vertices.ravel())
+    loop_start = np.empty(len(mesh.polygons), np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    vertex_index = np.empty(len(mesh.loops), np.int32)
+    mesh.loops.foreach_get("vertex_index", vertex_index)
+    loop_uvs = None
+    if mesh.uv_layers:
+        loop_uvs = np.empty((len(mesh.loops), 2), np.float32)
+        mesh.uv_layers[0].uv.foreach_get("vector", loop_uvs.ravel())
+    return content_key(vertices[:, swizzle], loop_start, vertex_index, loop_uvs)
+
+
+def assign_vertex_weights(
+    vertex_groups: list[bpy.types.VertexGroup],
+    vertex_indices: np.ndarray,
+    group_indices: np.ndarray,
+    weights: np.ndarray,
+):
+    # Issue a single VertexGroup.add per distinct (group, weight) pair
+    # rather than one per influence.
+    if not len(vertex_indices):
+        return
+
+    order = np.lexsort((vertex_indices, weights, group_indices))
+    vertex_indices = vertex_indices[order]
+    group_indices = group_indices[order]
+    weights = weights[order]
+
+    boundaries = np.flatnonzero(
+        (np.diff(group_indices) != 0) | (np.diff(weights) != 0)
+    )
+    starts = np.concatenate(([0], boundaries + 1))
+    ends = np.concatenate((boundaries + 1, [len(order)]))
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        vertex_groups[group_indices[start]].add(
+            vertex_indices[start:end].tolist(), float(weights[start]), "REPLACE"
         )
-        armature_object: bpy.types.Object = bpy.context.active_object
-        armature: bpy.types.Armature = armature_object.data
 
-        # set up the root pelvis bone
-        armature.edit_bones[0].name = "PELVIS"
-        armature.edit_bones[0].head = armature_root
-        armature.edit_bones[0].length = 0.2
-        armatureSpaceBonePositions[0] = armature_root
-        boneObjects.append(armature.edit_bones[0])
 
-        # parent the mesh object to the armature and give it an armature deform
-        obj.parent = armature_object
-        obj.parent_type = "ARMATURE"
+def bind_pose_positions(
+    vertices: np.ndarray,
+    skin: Skin,
+    bone_positions: np.ndarray,
+) -> np.ndarray:
+    # Each influence stores the vertex as an offset from its bone; the bind
+    # pose position is the weighted sum of (offset + bone position).
+    offsets = (
+        skin.offsets[:, :, swizzle] * bone_scale + bone_positions[skin.bone_indices]
+    )
+    positions = np.einsum("nk,nkc->nc", skin.weights, offsets)
+
+    # Unweighted vertices keep the position stored in the file
+    unweighted = skin.weights[:, 0] <= 0.0
+    positions[unweighted] = vertices[unweighted][:, swizzle]
+    return positions.astype(np.float32)
+
+
+def build_bones(
+    context: bpy.types.Context,
+    armature_object: bpy.types.Object,
+    skeleton: Skeleton,
+    bone_positions: np.ndarray,
+):
+    # Bones can only be created in edit mode, so this is the one mode switch
+    # needed per armature data-block.
+    if context.mode != "OBJECT":
+        bpy.ops.object.mode_set(mode="OBJECT")
+
+    # Edit mode works on the active object; the user's one is restored once
+    # the bones are built
+    previous_active = context.view_layer.objects.active
+    context.view_layer.objects.active = armature_object
+    with context.temp_override(
+        active_object=armature_object,
+        object=armature_object,
+        selected_objects=[armature_object],
+        selected_editable_objects=[armature_object],
+    ):
+        bpy.ops.object.mode_set(mode="EDIT")
+
+        armature: bpy.types.Armature = armature_object.data
+        boneObjects: list[bpy.types.EditBone] = []
+
+        # set up the root pelvis bone, pointing up like a default bone
+        pelvisBone = armature.edit_bones.new(skeleton.names[0])
+        pelvisBone.tail = (0.0, 0.0, 1.0)
+        pelvisBone.head = armature_root
+        pelvisBone.length = 0.2
+        boneObjects.append(pelvisBone)
 
         # set up editbones, skipping pelvis
-        for bone_index in range(1, 16):
-            linkedBoneIdx = bone_linkages[bone_index]
-            fileBonePos = mathutils.Vector(bones[bone_index])
-            bonePos = (
-                mathutils.Vector((fileBonePos.x, fileBonePos.z, fileBonePos.y)) * 1.125
-            )
-            lastBonePos = armatureSpaceBonePositions[linkedBoneIdx]
+        for bone_index in range(1, len(skeleton)):
+            linkedBoneIdx = skeleton.linkages[bone_index]
 
-            editBone = armature.edit_bones.new(bone_names[bone_index])
+            editBone = armature.edit_bones.new(skeleton.names[bone_index])
             editBone.parent = boneObjects[linkedBoneIdx]
-            editBone.matrix = mathutils.Matrix.Translation(
-                lastBonePos
-            ) @ mathutils.Matrix.Translation(bonePos)
+            editBone.matrix = mathutils.Matrix.Translation(bone_positions[bone_index])
             editBone.tail = boneObjects[linkedBoneIdx].head
 
             boneObjects.append(editBone)
-            armatureSpaceBonePositions[bone_index] = lastBonePos + bonePos
-
-        if vertex_weights:
-            vertexGroups: list[bpy.types.VertexGroup] = []
-
-            for bone_index in range(0, 16):
-                vertexGroups.append(obj.vertex_groups.new(name=bone_names[bone_index]))
-            for index, weights in enumerate(vertex_weights):
-                weightIndices: list[int] = [0] * 4
-                weightValues: list[float] = [1.0, 0.0, 0.0, 0.0]
-                weightOffsets: list[mathutils.Vector] = []
-                weightCount = 0
-                for boneIndex, innerWeights in enumerate(weights):
-                    if weightCount >= 4:
-                        break
-                    if innerWeights[3] <= 0.0:
-                        continue
-
-                    weightIndices[weightCount] = boneIndex
-                    weightValues[weightCount] = innerWeights[3]
-                    weightOffset = (
-                        mathutils.Vector(
-                            (innerWeights[0], innerWeights[2], innerWeights[1])
-                        )
-                        * 1.125
-                    )
-                    weightOffsets.append(weightOffset)
-
-                    weightCount += 1
-
-                newVertPosition = mathutils.Vector((0, 0, 0))
-                for weightIndex, indice in enumerate(weightIndices):
-                    if weightValues[weightIndex] <= 0.0:
-                        break
-                    vertexGroups[indice].add(
-                        [index], weightValues[weightIndex], "REPLACE"
-                    )
-                    newVertPosition += (
-                        weightOffsets[weightIndex] + armatureSpaceBonePositions[indice]
-                    ) * weightValues[weightIndex]
-
-                if weightCount > 0:
-                    mesh.vertices[index].co = newVertPosition
 
-        armature_modifier: bpy.types.ArmatureModifier = obj.modifiers.new(
-            "Armature", "ARMATURE"
+        bpy.ops.object.mode_set(mode="OBJECT")
+
+    context.view_layer.objects.active = previous_active
+
+
+def armature_key(skeleton: Skeleton, bones: np.ndarray) -> str:
+    key = hashlib.sha1(np.ascontiguousarray(bones, dtype=np.float32))
+    key.update("/".join(skeleton.names).encode())
+    return key.hexdigest()
+
+
+def find_armature(
+    key: str, exclude: Optional[bpy.types.Armature] = None
+) -> Optional[bpy.types.Armature]:
+    for candidate in bpy.data.armatures:
+        if (
+            candidate.get("subrosa_bones") == key
+            and not candidate.library
+            and candidate != exclude
+        ):
+            return candidate
+    return None
+
+
+def load_armature(
+    session: ImportSession,
+    skeleton: Skeleton,
+    bones: np.ndarray,
+    bone_positions: np.ndarray,
+    share_armature: bool = False,
+) -> bpy.types.Object:
+    key = armature_key(skeleton, bones)
+
+    armature: Optional[bpy.types.Armature] = None
+    if share_armature:
+        armature = find_armature(key)
+
+    isNew = armature is None
+    if isNew:
+        armature = bpy.data.armatures.new("Armature")
+        armature["subrosa_bones"] = key
+
+    armature_object = bpy.data.objects.new("Armature", armature)
+    session.add(armature_object, link=isNew)
+    if isNew:
+        build_bones(session.context, armature_object, skeleton, bone_positions)
+
+    return armature_object
+
+
+def skin_mesh(
+    obj: bpy.types.Object,
+    vertices: np.ndarray,
+    vertex_weights: Skin,
+    skeleton: Skeleton,
+    bone_positions: np.ndarray,
+):
+    # Bone groups that already exist (on reload) have their weights cleared
+    # first, any other groups are left alone
+    vertexGroups: list[bpy.types.VertexGroup] = []
+    for bone_name in skeleton.names:
+        group = obj.vertex_groups.get(bone_name)
+        if group is None:
+            group = obj.vertex_groups.new(name=bone_name)
+        else:
+            group.remove(list(range(len(obj.data.vertices))))
+        vertexGroups.append(group)
+
+    # unweighted vertices are bound to the pelvis
+    influences = vertex_weights.weights > 0.0
+    vertexIndices, slots = np.nonzero(influences)
+    boneIndices = vertex_weights.bone_indices[vertexIndices, slots]
+    weightValues = vertex_weights.weights[vertexIndices, slots]
+
+    unweighted = np.flatnonzero(~influences[:, 0])
+    assign_vertex_weights(
+        vertexGroups,
+        np.concatenate((vertexIndices, unweighted)),
+        np.concatenate((boneIndices, np.zeros_like(unweighted))),
+        np.concatenate((weightValues, np.ones(len(unweighted), np.float32))),
+    )
+
+    obj.data.vertices.foreach_set(
+        "co", bind_pose_positions(vertices, vertex_weights, bone_positions).ravel()
+    )
+
+
+def update_mesh(
+    mesh: bpy.types.Mesh,
+    vertices: np.ndarray,
+    polygons: Polygons,
+    vertex_uvs: Optional[np.ndarray],
+) -> bool:
+    # Overwrites positions and UVs in place, leaving everything else on the
+    # mesh untouched. Returns False when the topology differs, in which case
+    # the mesh has to be replaced instead.
+    if (len(mesh.vertices), len(mesh.loops), len(mesh.polygons)) != (
+        len(vertices),
+        len(polygons.vertex_index),
+        len(polygons.loop_start),
+    ):
+        return False
+
+    vertex_index = np.empty(len(mesh.loops), np.int32)
+    mesh.loops.foreach_get("vertex_index", vertex_index)
+    loop_start = np.empty(len(mesh.polygons), np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    if not (
+        np.array_equal(vertex_index, polygons.vertex_index)
+        and np.array_equal(loop_start, polygons.loop_start)
+    ):
+        return False
+
+    mesh.vertices.foreach_set(
+        "co", np.ascontiguousarray(vertices[:, swizzle], dtype=np.float32).ravel()
+    )
+    if vertex_uvs is not None:
+        layer = mesh.uv_layers[0] if mesh.uv_layers else mesh.uv_layers.new()
+        loop_uvs = vertex_uvs[polygons.vertex_index]
+        layer.uv.foreach_set(
+            "vector", np.ascontiguousarray(loop_uvs, dtype=np.float32).ravel()
         )
-        armature_modifier.object = armature_object
 
-    if bpy.context.active_object is not None:
-        bpy.ops.object.mode_set(mode="OBJECT")
+    mesh.update()
+    if "subrosa_mesh" in mesh:
+        mesh["subrosa_mesh"] = mesh_key(vertices, polygons, vertex_uvs)
+    return True
+
+
+def replace_mesh(
+    obj: bpy.types.Object,
+    vertices: np.ndarray,
+    polygons: Polygons,
+    vertex_uvs: Optional[np.ndarray],
+):
+    # Swap in freshly built mesh data; the object keeps its modifiers,
+    # vertex groups and transform, the mesh keeps its name and materials
+    old_mesh: bpy.types.Mesh = obj.data
+    mesh = new_mesh(old_mesh.name, vertices, polygons, vertex_uvs)
+    for material in old_mesh.materials:
+        mesh.materials.append(material)
+    if "subrosa_mesh" in old_mesh:
+        mesh["subrosa_mesh"] = mesh_key(vertices, polygons, vertex_uvs)
+
+    obj.data = mesh
+    if old_mesh.users == 0:
+        name = old_mesh.name
+        bpy.data.meshes.remove(old_mesh)
+        mesh.name = name
 
-    view_layer = context.view_layer
-    collection = view_layer.active_layer_collection.collection
 
-    collection.objects.link(obj)
-    obj.select_set(True)
+def load_mesh(
+    session: ImportSession,
+    name: str,
+    vertices: np.ndarray,
+    polygons: Polygons,
+    vertex_uvs: Optional[np.ndarray],
+    vertex_weights: Optional[Skin],
+    bones: Optional[np.ndarray],
+    share_armature: bool = False,
+    skeleton: Skeleton = standard_skeleton,
+    part: str = "",
+    share_mesh: bool = False,
+) -> bpy.types.Object:
+    # `part` tells apart the objects built from one file (e.g. a vehicle's
+    # collision mesh) and is appended to the name
+    skinned = bones is not None and len(bones) > 0
+
+    # Skinned meshes are moved into their bind pose and weighted, so only
+    # unskinned ones are keyed by content and shared
+    mesh: Optional[bpy.types.Mesh] = None
+    if not skinned:
+        key = mesh_key(vertices, polygons, vertex_uvs)
+        if share_mesh:
+            mesh = session.find_mesh(key)
+    if mesh is None:
+        mesh = new_mesh(name + part, vertices, polygons, vertex_uvs)
+        if not skinned:
+            session.add_mesh(key, mesh)
+
+    obj = bpy.data.objects.new(name + part, mesh)
+    obj["subrosa_part"] = part
+
+    if skinned:
+        armatureSpaceBonePositions = skeleton.armature_positions(bones)
+        armature_object = load_armature(
+            session, skeleton, bones, armatureSpaceBonePositions, share_armature
+        )
+
+        # parent the mesh object to the armature and give it an armature deform
+        obj.parent = armature_object
+        obj.parent_type = "ARMATURE"
+
+        if vertex_weights is not None:
+            skin_mesh(
+                obj, vertices, vertex_weights, skeleton, armatureSpaceBonePositions
+            )
+
+        armature_modifier: bpy.types.ArmatureModifier = obj.modifiers.new(
+            "Armature", "ARMATURE"
+        )
+        armature_modifier.object = armature_object
 
-    view_layer.update()
+    session.add(obj)
+    return obj
@@ -0,0 +1,124 @@
+import numpy as np
+from .codec import swizzle
+
+armature_root = (0.0, 0.0625, -0.1875)
+# Bone and weight offsets are stored scaled down by this factor
+bone_scale = 1.125
+
+
+class Skeleton:
+    """Bone names and parent linkage of a character format"""
+
+    def __init__(self, names: tuple[str, ...], linkages: tuple[int, ...]):
+        assert len(names) == len(linkages), "Every bone needs a parent."
+        self.names = names
+        self.linkages = linkages
+        self.indices = {name: index for index, name in enumerate(names)}
+
+        # ancestry[i, j] is 1 when bone j lies on the chain from the root to
+        # bone i, so armature-space positions are one matrix product over
+        # the parent-relative offsets. The root bone is placed explicitly.
+        self.ancestry = np.zeros((len(names), len(names)))
+        for bone_index in range(1, len(names)):
+            self.ancestry[bone_index] = self.ancestry[linkages[bone_index]]
+            self.ancestry[bone_index, bone_index] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def armature_positions(self, bones: np.ndarray) -> np.ndarray:
+        # File bone positions are offsets from the parent bone, scaled down
+        offsets = bones[: len(self), swizzle].astype(np.float64) * bone_scale
+        return self.ancestry @ offsets + armature_root
+
+
+def bone_offsets(
+    skeleton: Skeleton, positions: np.ndarray, present: np.ndarray
+) -> np.ndarray:
+    # The file stores each bone relative to its parent, scaled down. Bones
+    # missing from the armature, or whose parent is missing, get no offset.
+    linkages = np.array(skeleton.linkages)
+    offsets = (positions - positions[linkages]) / bone_scale
+    offsets[~(present & present[linkages])] = 0.0
+    offsets[0] = 0.0
+    return offsets
+
+
+def skin_weights(
+    skeleton: Skeleton,
+    positions: np.ndarray,
+    group_pairs: tuple[np.ndarray, np.ndarray, np.ndarray],
+    bone_positions: np.ndarray,
+    bones_present: np.ndarray,
+) -> np.ndarray:
+    # Returns an (x, y, z, weight) record for every bone of every vertex,
+    # keeping the 4 strongest influences of each vertex.
+    vertex_count = len(positions)
+    bone_count = len(skeleton)
+    pair_vertices, pair_bones, pair_weights = group_pairs
+
+    weights = np.zeros((vertex_count, bone_count), np.float32)
+    valid = (pair_bones >= 0) & (pair_weights > 0.0)
+    weights[pair_vertices[valid], pair_bones[valid]] = pair_weights[valid]
+
+    if bone_count > 4:
+        strongest = np.argpartition(-weights, 3, axis=1)[:, :4]
+        keep = np.zeros_like(weights, bool)
+        np.put_along_axis(keep, strongest, True, axis=1)
+        weights[~keep] = 0.0
+
+    offsets = (positions[:, None, :] - bone_positions[None, :, :]) / bone_scale
+    offsets[(weights <= 0.0) | ~bones_present[None, :]] = 0.0
+
+    # Vertices without any influence are bound to the pelvis, with their
+    # offset from it so they stay in place
+    unweighted = ~weights.any(axis=1)
+    weights[unweighted, 0] = 1.0
+    offsets[unweighted, 0] = (positions[unweighted] - bone_positions[0]) / bone_scale
+
+    return np.concatenate((offsets, weights[:, :, None]), axis=2)
+
+
+standard_skeleton = Skeleton(
+    (
+        "PELVIS",
+        "STOMACH",
+        "TORSO",
+        "HEAD",
+        "LEFTSHOULDER",
+        "LEFTFOREARM",
+        "LEFTHAND",
+        "RIGHTSHOULDER",
+        "RIGHTFOREARM",
+        "RIGHTHAND",
+        "LEFTTHIGH",
+        "LEFTSHIN",
+        "LEFTFOOT",
+        "RIGHTTHIGH",
+        "RIGHTSHIN",
+        "RIGHTFOOT",
+    ),
+    (0, 0, 1, 2, 2, 4, 5, 2, 7, 8, 0, 10, 11, 0, 13, 14),
+)
+
+# Older builds of the game have no STOMACH bone
+legacy_skeleton = Skeleton(
+    (
+        "PELVIS",
+        "TORSO",
+        "HEAD",
+        "LEFTSHOULDER",
+        "LEFTFOREARM",
+        "LEFTHAND",
+        "RIGHTSHOULDER",
+        "RIGHTFOREARM",
+        "RIGHTHAND",
+        "LEFTTHIGH",
+        "LEFTSHIN",
+        "LEFTFOOT",
+        "RIGHTTHIGH",
+        "RIGHTSHIN",
+        "RIGHTFOOT",
+    ),
+    (0, 0, 1, 1, 3, 4, 1, 6, 7, 0, 9, 10, 0, 12, 13),
+)
@@ -0,0 +1,11 @@
+import importlib.util
+import os
+import sys
+
+# The add-on's __init__ needs Blender, so the modules that do not are
+# imported from a package of their own that skips it
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_loader("subrosa", None, is_package=True)
+package = importlib.util.module_from_spec(spec)
+package.__path__ = [root]
+sys.modules.setdefault("subrosa", package)
@@ -0,0 +1,285 @@
+from struct import pack
+
+import numpy as np
+
+from subrosa import codec
+
+vertices = [(0.0, 1.0, 2.0), (3.0, 4.0, 5.0), (6.0, 7.0, 8.0), (9.0, 10.0, 11.0)]
+uvs = [(0.0, 0.25), (0.5, 0.75), (1.0, 0.0), (0.25, 0.5)]
+
+
+def pack_vertices() -> bytes:
+    data = pack("<i", len(vertices))
+    for co, uv in zip(vertices, uvs):
+        data += pack("<fff", *co) + pack("<ff", *uv)
+    return data
+
+
+def pack_itm(faces) -> bytes:
+    # Version 1, 24 unused bytes, a node table, vertices, then polygons
+    # with their own corner counts
+    data = pack("<i", 1) + bytes(4 * 6)
+    data += pack("<i", 2) + bytes(4 * 4 * 2)
+    data += pack_vertices()
+    data += pack("<i", len(faces))
+    for face in faces:
+        data += pack("<i", len(face)) + pack(f"<{len(face)}i", *face)
+    return data
+
+
+def pack_sit(faces) -> bytes:
+    # Version 2, a 64-byte texture name, vertices, then triangles
+    data = pack("<i", 2) + b"texture.png".ljust(64, b"\0")
+    data += pack_vertices()
+    data += pack("<i", len(faces))
+    for face in faces:
+        data += pack("<iii", *face)
+    return data
+
+
+def assert_mesh(decoded: codec.DecodedMesh, faces):
+    np.testing.assert_array_equal(decoded.vertices, vertices)
+    np.testing.assert_array_equal(decoded.vertex_uvs, uvs)
+    polygons = decoded.polygons
+    np.testing.assert_array_equal(polygons.loop_total, [len(face) for face in faces])
+    np.testing.assert_array_equal(
+        polygons.vertex_index, [index for face in faces for index in face]
+    )
+
+
+def test_decode_itm():
+    faces = [(0, 1, 2, 3), (0, 2, 1)]
+    assert_mesh(codec.decode_itm(pack_itm(faces)), faces)
+
+
+def test_decode_sit():
+    faces = [(0, 1, 2), (2, 3, 0)]
+    assert_mesh(codec.decode_sit(pack_sit(faces)), faces)
+
+
+def test_layouts_reject_each_other():
+    faces = [(0, 1, 2)]
+    for decode, data in (
+        (codec.decode_itm, pack_sit(faces)),
+        (codec.decode_sit, pack_itm(faces)),
+    ):
+        try:
+            decode(data)
+        except AssertionError:
+            continue
+        raise AssertionError(f"{decode.__name__} accepted the other format")
+
+
+# Filler for bytes the decoders must skip; it would read as a plausible
+# count or index if a layout were off by a field
+junk = pack("<i", 7)
+
+
+def pack_polygons(faces, head=b"", corner=b"", tail=b"") -> bytes:
+    data = pack("<i", len(faces))
+    for face in faces:
+        data += head + pack("<i", len(face))
+        for index in face:
+            data += pack("<i", index) + corner
+        data += tail
+    return data
+
+
+def expected_polygons(faces):
+    loop_total = [len(face) for face in faces]
+    loop_start = np.concatenate(([0], np.cumsum(loop_total)[:-1]))
+    return loop_start, loop_total, [index for face in faces for index in face]
+
+
+def assert_polygons(polygons: codec.Polygons, faces):
+    loop_start, loop_total, vertex_index = expected_polygons(faces)
+    np.testing.assert_array_equal(polygons.loop_start, loop_start)
+    np.testing.assert_array_equal(polygons.loop_total, loop_total)
+    np.testing.assert_array_equal(polygons.vertex_index, vertex_index)
+
+
+def pack_cmo(version: int, faces) -> bytes:
+    data = pack("<4sii", b"CMod", version, len(vertices))
+    for co, uv in zip(vertices, uvs):
+        data += pack("<fff", *co)
+        if version >= 3:
+            data += pack("<ff", *uv)
+        data += junk
+    tail = junk * (2 if version > 1 else 1)
+    return data + pack_polygons(faces, tail=tail)
+
+
+def test_decode_cmo_versions():
+    faces = [(0, 1, 2), (2, 3, 0)]
+    for version in (1, 2, 3):
+        decoded = codec.decode_cmo(pack_cmo(version, faces))
+        np.testing.assert_array_equal(decoded.vertices, vertices)
+        expected_uvs = uvs if version >= 3 else np.zeros((len(vertices), 2))
+        np.testing.assert_array_equal(decoded.vertex_uvs, expected_uvs)
+        assert_polygons(decoded.polygons, faces)
+
+
+def test_decode_cmo_mixed_corner_counts():
+    # A quad first predicts a stride the triangles after it do not have
+    faces = [(0, 1, 2, 3), (0, 2, 1), (1, 2, 3), (3, 2, 1, 0)]
+    for version in (1, 2, 3):
+        assert_polygons(codec.decode_cmo(pack_cmo(version, faces)).polygons, faces)
+
+
+def pack_sbv(version: int, faces, collision_faces, windows) -> bytes:
+    data = pack("<i", version)
+    if version >= 5:
+        data += junk * 3
+
+    data += pack("<i", len(vertices))
+    for co in vertices:
+        data += pack("<fff", *co) + junk
+    data += pack("<i", 2) + junk * 3 * 2
+    data += pack_polygons(collision_faces)
+
+    data += pack("<i", len(vertices))
+    for co in vertices:
+        data += pack("<fff", *co)
+    data += pack_polygons(faces, head=junk, corner=junk * 4, tail=junk * 4)
+
+    data += pack("<i", len(windows))
+    for window in windows:
+        data += pack("<i", len(window))
+        for co in window:
+            data += pack("<fff", *co)
+    return data
+
+
+def test_decode_sbv():
+    faces = [(0, 1, 2, 3), (0, 2, 1)]
+    collision_faces = [(0, 1, 2), (0, 1, 2, 3)]
+    windows = [vertices[:3], vertices]
+    for version in (4, 5):
+        decoded = codec.decode_sbv(pack_sbv(version, faces, collision_faces, windows))
+
+        np.testing.assert_array_equal(decoded.body.vertices, vertices)
+        assert_polygons(decoded.body.polygons, faces)
+
+        # Collision faces and windows are stored with the opposite winding
+        np.testing.assert_array_equal(decoded.collision.vertices, vertices)
+        assert_polygons(
+            decoded.collision.polygons, [face[::-1] for face in collision_faces]
+        )
+
+        # Every window corner is its own vertex, in file order
+        np.testing.assert_array_equal(
+            decoded.windows.vertices, [co for window in windows for co in window]
+        )
+        assert_polygons(decoded.windows.polygons, [(2, 1, 0), (6, 5, 4, 3)])
+
+
+def reference_index(buffer: bytes, offset: int, count: int, corner_size, head, tail):
+    # The record walk the original readers did, one prefix at a time
+    record_offsets = []
+    loop_total = []
+    for _ in range(count):
+        (total,) = np.frombuffer(buffer, "<i4", 1, offset + head)
+        record_offsets.append(offset)
+        loop_total.append(total)
+        offset += head + 4 + total * corner_size + tail
+    return record_offsets, loop_total, offset
+
+
+def test_index_polygons_fast_and_slow_paths():
+    for faces in (
+        # Same corner count throughout: the predicted stride holds
+        [(0, 1, 2)] * 5,
+        [(0, 1, 2, 3)] * 3,
+        # Mixed: the prediction fails somewhere and every record is walked
+        [(0, 1, 2), (0, 1, 2, 3), (0, 1, 2)],
+        [(0, 1, 2, 3), (0, 1, 2), (0, 1, 2)],
+        [(0, 1, 2)] * 4 + [(0, 1, 2, 3)],
+    ):
+        for corner_size, head, tail in ((4, 0, 0), (4, 0, 8), (4 + 16, 4, 16)):
+            corner = junk * ((corner_size - 4) // 4)
+            data = pack_polygons(faces, junk * (head // 4), corner, junk * (tail // 4))
+            record_offsets, loop_total, end = codec.index_polygons(
+                data, 4, len(faces), corner_size, head, tail
+            )
+            expected = reference_index(data, 4, len(faces), corner_size, head, tail)
+            np.testing.assert_array_equal(record_offsets, expected[0])
+            np.testing.assert_array_equal(loop_total, expected[1])
+            assert end == expected[2] == len(data)
+
+
+# The struct loops the exporters used to write with; encoders must match
+# them byte for byte
+
+
+def struct_cmc(bones, verts, weights, uvs, faces) -> bytes:
+    data = b"CMod" + pack("<i", 2)
+    data += pack("<i", len(bones))
+    for x, z, y in bones:
+        data += pack("<fff", x, y, z)
+    data += pack("<i", len(verts))
+    for (x, z, y), vertex_weights, (u, v) in zip(verts, weights, uvs):
+        data += pack("<fff", x, y, z)
+        for xw, zw, yw, w in vertex_weights:
+            data += pack("<ffff", xw, yw, zw, w)
+        data += pack("<ff", u, v)
+    data += pack("<i", len(faces))
+    for face in faces:
+        data += pack("<iii", *face)
+    return data
+
+
+def struct_cmo(verts, uvs, faces) -> bytes:
+    data = b"CMod" + pack("<i", 3)
+    data += pack("<i", len(verts))
+    for (x, z, y), (u, v) in zip(verts, uvs):
+        data += pack("<fff", x, y, z)
+        data += pack("<fff", u, v, 0.0)
+    data += pack("<i", len(faces))
+    for face in faces:
+        data += pack("<i", 3)
+        data += pack("<iii", *face)
+        data += pack("<ii", 0, 0)
+    return data
+
+
+def test_encoders_match_struct_writers():
+    rng = np.random.default_rng(0)
+    verts = rng.standard_normal((6, 3)).astype(np.float32)
+    uvs = rng.random((6, 2)).astype(np.float32)
+    faces = rng.integers(0, 6, (4, 3)).astype(np.int32)
+    for bone_count in (16, 15, 0):
+        bones = rng.standard_normal((bone_count, 3)).astype(np.float32)
+        weights = rng.standard_normal((6, bone_count, 4)).astype(np.float32)
+        encoded = b"".join(
+            bytes(section)
+            for section in codec.encode_cmc(bones, verts, weights, uvs, faces)
+        )
+        assert encoded == struct_cmc(bones, verts, weights, uvs, faces)
+
+    sections = codec.encode_cmo(verts, uvs, faces)
+    encoded = b"".join(bytes(section) for section in sections)
+    assert encoded == struct_cmo(verts, uvs, faces)
+
+
+def test_split_uv_seams():
+    # Two triangles sharing the edge 1-2, with a UV seam along vertex 2;
+    # vertex 0 uses both 0.0 and -0.0, which are the same UV
+    loop_vertices = np.array([0, 1, 2, 2, 1, 3, 0], np.int32)
+    loop_uvs = np.array(
+        [[0.0, 0.0], [0.5, 0.0], [0.5, 0.5], [0.9, 0.5], [0.5, 0.0], [1.0, 1.0]]
+        + [[-0.0, 0.0]],
+        np.float32,
+    )
+    source_vertices, vertex_uvs, loop_remap = codec.split_uv_seams(
+        loop_vertices, loop_uvs
+    )
+
+    # One output vertex per distinct (vertex, uv): vertex 2 is split in two
+    assert len(source_vertices) == 5
+    assert len(loop_remap) == len(loop_vertices)
+    # Every loop keeps its vertex and UV through the remap
+    np.testing.assert_array_equal(source_vertices[loop_remap], loop_vertices)
+    np.testing.assert_array_equal(vertex_uvs[loop_remap], loop_uvs)
+    assert loop_remap[0] == loop_remap[6]
+    assert loop_remap[1] == loop_remap[4]
+    assert loop_remap[2] != loop_remap[3]
@@ -0,0 +1,96 @@
+import numpy as np
+
+from subrosa.skeleton import bone_offsets, bone_scale, skin_weights, standard_skeleton
+
+skeleton = standard_skeleton
+rng = np.random.default_rng(0)
+bone_positions = rng.standard_normal((len(skeleton), 3)).astype(np.float32)
+
+
+def pairs(*influences):
+    # (vertex, bone, weight) triples as vertex_group_pairs returns them
+    vertices, bones, weights = zip(*influences)
+    return np.array(vertices), np.array(bones), np.array(weights, np.float32)
+
+
+def test_bone_offsets_skip_missing_bones_and_parents():
+    present = np.ones(len(skeleton), bool)
+    # TORSO is missing, so it and its children (HEAD, both shoulders) get
+    # no offset
+    torso = skeleton.indices["TORSO"]
+    present[torso] = False
+    offsets = bone_offsets(skeleton, bone_positions, present)
+
+    linkages = np.array(skeleton.linkages)
+    expected = (bone_positions - bone_positions[linkages]) / bone_scale
+    expected[0] = 0.0
+    zeroed = [torso] + [
+        bone for bone in range(len(skeleton)) if skeleton.linkages[bone] == torso
+    ]
+    expected[zeroed] = 0.0
+    np.testing.assert_allclose(offsets, expected)
+    assert not offsets[zeroed].any()
+
+
+def test_skin_weights_keep_four_strongest():
+    positions = rng.standard_normal((1, 3)).astype(np.float32)
+    present = np.ones(len(skeleton), bool)
+    weights = [0.1, 0.5, 0.2, 0.9, 0.3, 0.05]
+    records = skin_weights(
+        skeleton,
+        positions,
+        pairs(*((0, bone, weight) for bone, weight in enumerate(weights))),
+        bone_positions,
+        present,
+    )
+
+    assert records.shape == (1, len(skeleton), 4)
+    np.testing.assert_allclose(records[0, :6, 3], [0.0, 0.5, 0.2, 0.9, 0.3, 0.0])
+    kept = [1, 2, 3, 4]
+    np.testing.assert_allclose(
+        records[0, kept, :3], (positions[0] - bone_positions[kept]) / bone_scale
+    )
+    # Dropped and unused bones carry nothing
+    dropped = np.setdiff1d(np.arange(len(skeleton)), kept)
+    assert not records[0, dropped].any()
+
+
+def test_skin_weights_ignore_other_groups_and_missing_bones():
+    positions = rng.standard_normal((1, 3)).astype(np.float32)
+    present = np.ones(len(skeleton), bool)
+    present[2] = False
+    # A group that is not a bone (-1), a zero weight, and a missing bone
+    records = skin_weights(
+        skeleton,
+        positions,
+        pairs((0, -1, 1.0), (0, 1, 0.0), (0, 2, 0.4), (0, 3, 0.6)),
+        bone_positions,
+        present,
+    )
+
+    np.testing.assert_allclose(records[0, [1, 2, 3], 3], [0.0, 0.4, 0.6])
+    # The missing bone keeps its weight but has no offset to write
+    assert not records[0, 2, :3].any()
+    np.testing.assert_allclose(
+        records[0, 3, :3], (positions[0] - bone_positions[3]) / bone_scale
+    )
+
+
+def test_unweighted_vertices_stay_in_place_on_the_pelvis():
+    positions = rng.standard_normal((2, 3)).astype(np.float32)
+    present = np.ones(len(skeleton), bool)
+    records = skin_weights(
+        skeleton, positions, pairs((1, 4, 1.0)), bone_positions, present
+    )
+
+    # Vertex 0 has no influence: full pelvis weight, at its real offset
+    assert records[0, 0, 3] == 1.0
+    assert not records[0, 1:].any()
+    np.testing.assert_allclose(
+        records[0, 0, :3], (positions[0] - bone_positions[0]) / bone_scale
+    )
+    # Binding it back gives the original position
+    np.testing.assert_allclose(
+        records[0, 0, :3] * bone_scale + bone_positions[0], positions[0], rtol=1e-6
+    )
+    assert records[1, 0, 3] == 0.0